@@ -1013,11 +1013,9 @@ const App = () => {
         }
         
         try {
-            setMessage('1/2: Verifying session token...');
-            await callApi('/verify-token', requestBody);
-
-            setMessage('2/2: Starting session and reserving server space...');
-            const sessionResponse = await callApi('/session/start', requestBody);
+            // Verify token + start session in one round trip
+            setMessage('Verifying token and starting session...');
+            const sessionResponse = await callApi('/session/verify-and-start', requestBody);
 
             setFolderName(sessionResponse.folder);
             
@@ -1,27 +1,28 @@
 """
 AI Analysis Service with Queue Integration
 - Unified speech-to-text + analysis + emotion + pace in single API call
-- Queue-based processing with 15s throttling
+- Queue-based processing, rate limited to 4 requests per 60s window
 - Auto-retry with 70s delay
 """
 import os
 import time
-import json
 import re
+import random
+import orjson
+import asyncio
 import google.generativeai as genai
 from dotenv import load_dotenv
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import TypedDict
 
-from tenacity import (
-    retry, 
-    stop_after_attempt, 
-    stop_after_delay,
-    wait_random_exponential,
-    retry_if_exception_type
-)
 from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable, InternalServerError
 
+from server import result_cache
 from server.job_queue import analysis_queue
+from server.meta_store import load_meta, save_meta, meta_lock
 
 # Configuration
 logging.basicConfig(level=logging.INFO)
@@ -36,57 +37,17 @@ else:
     genai.configure(api_key=api_key)
 
 
-def clean_json_string(text):
-    """Clean JSON string by removing markdown code blocks"""
-    cleaned = text.strip()
-    if cleaned.startswith("```"):
-        cleaned = re.sub(r"^```[a-z]*\n", "", cleaned, flags=re.MULTILINE)
-        cleaned = re.sub(r"\n```$", "", cleaned, flags=re.MULTILINE)
-    return cleaned.strip()
-
-
-# --- UNIFIED AI ANALYSIS WITH BASIC RETRY (Let queue handle auto-retry logic) ---
-@retry(
-    retry=retry_if_exception_type((
-        ResourceExhausted,
-        ServiceUnavailable,
-        InternalServerError,
-        json.JSONDecodeError,
-        ConnectionError,
-        OSError
-    )),
-    wait=wait_random_exponential(multiplier=2, min=4, max=64), 
-    stop=stop_after_attempt(1),  # Only 1 attempt, let queue handle retries with 70s delay
-    reraise=True 
-)
-def analyze_video_with_gemini(video_path: str, question_text: str, duration_seconds: int = 0) -> dict:
-    """
-    Unified API call: ONE request gets transcript + score + emotion + pace.
-    
-    Returns dict with transcript, match_score, feedback, emotion, emotion_score, pace_wpm, pace_label.
-    """
-    logger.info(f"[AI] Starting unified analysis for: {os.path.basename(video_path)}")
-    
-    raw_response = ""
-    
-    try:
-        # STEP 1: UPLOAD VIDEO
-        logger.info(f"[AI] Uploading video...")
-        video_file = genai.upload_file(path=video_path)
-        
-        while video_file.state.name == "PROCESSING":
-            time.sleep(1)
-            video_file = genai.get_file(video_file.name)
-        
-        if video_file.state.name == "FAILED":
-            raise ResourceExhausted("Google API failed to process video file")
-        
-        # STEP 2: SEND UNIFIED PROMPT
-        logger.info("[AI] Analyzing (Transcript + Score + Emotion)...")
-        
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        
-        prompt_text = f"""CRITICAL: You are a TRANSCRIBER ONLY. Your ONLY job is to transcribe audio word-for-word.
+class AnalysisResult(TypedDict):
+    """Shape Gemini must return for one video (enforced via response_schema)."""
+    transcript: str
+    match_score: int
+    feedback: str
+    emotion: str
+    emotion_score: int
+
+
+# Fixed instructions, sent once per request as system_instruction (only the question varies)
+_SYSTEM_PROMPT = """CRITICAL: You are a TRANSCRIBER ONLY. Your ONLY job is to transcribe audio word-for-word.
 You MUST NEVER hallucinate, invent, guess, or generate text that is NOT in the audio.
 
 ### STEP 0: AUDIO CONTENT DETECTION (DO THIS FIRST)
@@ -94,7 +55,7 @@ Before you do anything else, analyze the audio:
 - Is there clear human speech in the audio? (NOT just background noise, music, static, or silence)
 - Can you hear the candidate SPEAKING WORDS?
 
-If NO clear speech detected → Return EXACTLY: {{"transcript": "", "match_score": 0, "feedback": "No audible speech.", "emotion": "silent", "emotion_score": 0}}
+If NO clear speech detected → Return EXACTLY: {"transcript": "", "match_score": 0, "feedback": "No audible speech.", "emotion": "silent", "emotion_score": 0}
 STOP. Return this NOW. Do NOT continue to Step 1.
 
 ### STEP 1: TRANSCRIBE ONLY WHAT YOU HEAR (Anti-Hallucination Protocol)
@@ -120,7 +81,7 @@ WRONG: "Dạ em chào anh, em là Hạnh. Em tốt nghiệp ngành Kinh tế..."
 CORRECT: "" (empty if you can't hear anything)
 
 ### STEP 2: MATCH SCORE (0-100)
-How well addresses: "{question_text}"
+How well the transcript addresses the question the candidate is answering (given in the user message)
 * CRITERIA:
     * Score STRICTLY. Do not be generous.
     * 90-100: Exceptional, deep, structured, shows critical thinking and specific examples.
@@ -141,205 +102,370 @@ How well addresses: "{question_text}"
 One label: neutral, happy, stressed, confident, nervous, angry, calm, thoughtful, rushed, uncertain
 
 ### JSON RESPONSE (REQUIRED):
-{{"transcript": "<words only>", "match_score": <0-100>, "feedback": "<2-3 AI Feedback sentences>", "emotion": "<label>", "emotion_score": <0-100>}}
+{"transcript": "<words only>", "match_score": <0-100>, "feedback": "<2-3 AI Feedback sentences>", "emotion": "<label>", "emotion_score": <0-100>}
 """
+
+# One model instance shared by every job. Structured output mode: Gemini returns
+# JSON matching AnalysisResult, so the response goes straight to orjson.loads.
+_MODEL = genai.GenerativeModel(
+    "gemini-2.5-flash",
+    system_instruction=_SYSTEM_PROMPT,
+    generation_config={
+        "temperature": 0,
+        "response_mime_type": "application/json",
+        "response_schema": AnalysisResult
+    }
+)
+# Batch requests return one AnalysisResult per video
+_BATCH_CONFIG = {
+    "temperature": 0,
+    "response_mime_type": "application/json",
+    "response_schema": list[AnalysisResult]
+}
+
+# Retry policy for the generate call (the queue still retries whole jobs after 70s)
+GENERATE_MAX_ATTEMPTS = 3
+GENERATE_MAX_SECONDS = 180  # stop retrying once this much time has passed
+MAX_RETRY_DELAY = 70        # never wait longer than the queue's own retry delay
+BACKOFF_MIN = 4             # first backoff wait: 4s -> 8s -> 10s (+ up to 1s jitter)
+BACKOFF_MAX = 10
+# Errors worth retrying; OSError covers ConnectionError, TimeoutError and socket errors
+_RETRYABLE = (ResourceExhausted, ServiceUnavailable, InternalServerError, OSError)
+
+_WORD_RE = re.compile(r"\S+")
+_PACE_LABELS = ("slow", "normal", "fast")
+
+UPLOAD_BUFFER_SIZE = 65536  # 64 KB
+VIDEO_MIME_TYPE = "video/webm"
+# Existence checks only need one small field, not the whole session document
+EXISTS_CHECK_FIELDS = ['status']
+
+# Threads for the post-analysis writes (meta.json, transcript .txt, Firestore)
+_IO_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ai-io")
+# Threads for deleting uploaded files from Gemini after analysis
+_CLEANUP_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ai-cleanup")
+
+
+def _upload_video(video_path: str):
+    """Upload one answer video from a 64 KB buffered handle (blocking; run via asyncio.to_thread)."""
+    with open(video_path, "rb", buffering=UPLOAD_BUFFER_SIZE) as fh:
+        # Explicit mime type: answers are always saved as Qn.webm, no need for the SDK to guess
+        return genai.upload_file(
+            path=fh,
+            mime_type=VIDEO_MIME_TYPE,
+            display_name=os.path.basename(video_path)
+        )
+
+
+def _delete_remote(video_file):
+    """Delete an uploaded file from Gemini; failures are only logged."""
+    try:
+        video_file.delete()
+    except Exception as e:
+        logger.warning(f"[AI] Could not delete uploaded file {video_file.name}: {e}")
+
+
+def _delete_uploaded(video_file):
+    """Schedule deletion of an uploaded file without waiting for it."""
+    _CLEANUP_POOL.submit(_delete_remote, video_file)
+
+
+async def _await_processed(video_file):
+    """Wait for an uploaded file to leave PROCESSING, backing off 250ms -> 2s between polls."""
+    started = time.monotonic()
+    delay = 0.25
+    while video_file.state.name == "PROCESSING":
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, 2.0)
+        video_file = await asyncio.to_thread(genai.get_file, video_file.name)
+    logger.info(f"[AI] File {video_file.state.name} after {time.monotonic() - started:.2f}s")
+    return video_file
+
+
+def _server_retry_delay(error):
+    """Seconds the server asked us to wait before retrying a 429 (RetryInfo), or None."""
+    delay = getattr(error, 'retry_delay', None)
+    if delay is None:
+        for detail in getattr(error, 'details', None) or []:
+            delay = getattr(detail, 'retry_delay', None)
+            if delay is not None:
+                break
+    if delay is None:
+        return None
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    if hasattr(delay, 'nanos'):  # protobuf Duration
+        return delay.seconds + delay.nanos / 1e9
+    return float(delay)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for attempt 1, 2, ...: 4s, 8s, then capped at 10s."""
+    return min(BACKOFF_MAX, BACKOFF_MIN * 2 ** (attempt - 1)) + random.random()
+
+
+async def _generate_with_retry(model, contents, **kwargs):
+    """
+    model.generate_content_async with retry on transient API errors.
+    Waits the server's retry_delay on 429s, otherwise _backoff_delay(attempt).
+    """
+    deadline = time.monotonic() + GENERATE_MAX_SECONDS
+    for attempt in range(1, GENERATE_MAX_ATTEMPTS + 1):
+        try:
+            return await model.generate_content_async(contents, **kwargs)
+        except _RETRYABLE as e:
+            delay = _server_retry_delay(e) if isinstance(e, ResourceExhausted) else None
+            if delay is None:
+                delay = _backoff_delay(attempt)
+            delay = min(delay, MAX_RETRY_DELAY)
+            if attempt == GENERATE_MAX_ATTEMPTS or time.monotonic() + delay > deadline:
+                raise
+            logger.warning(f"[AI] {type(e).__name__}, retry {attempt}/{GENERATE_MAX_ATTEMPTS - 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def _question_prompt(question_text):
+    """Per-call user turn; everything else lives in _SYSTEM_PROMPT."""
+    return f'The candidate is answering the question: "{question_text}"'
+
+
+def _count_words(text: str) -> int:
+    """Number of whitespace-separated words, without building a list of them."""
+    return sum(1 for _ in _WORD_RE.finditer(text)) if text else 0
+
+
+def _compute_pace(word_count: int, duration_seconds: int):
+    """
+    Integer-only pace math: (wpm, pace_label, duration used).
+    Without a recorded duration, assume an average 140 WPM speaker.
+    """
+    actual = duration_seconds if duration_seconds > 0 else (word_count * 60) // 140
+    actual = max(1, actual)
+    wpm = (word_count * 60) // actual
+    label = 0 if wpm < 90 else (1 if wpm <= 150 else 2)
+    return wpm, _PACE_LABELS[label], actual
+
+
+def _save_raw_response(video_path: str, raw_response: str) -> str:
+    """Keep Gemini's raw output next to the video (Qn_raw.txt) instead of in the result dict."""
+    raw_path = Path(os.path.splitext(video_path)[0] + '_raw.txt')
+    try:
+        raw_path.write_text(raw_response, encoding='utf-8')
+    except Exception as e:
+        logger.warning(f"[AI] Could not save raw response to {raw_path.name}: {e}")
+    return str(raw_path)
+
+
+def _build_result(ai_data: dict, duration_seconds: int, raw_response_file: str) -> dict:
+    """Normalize one parsed Gemini answer and derive speaking pace from it."""
+    # Extract fields
+    transcript = ai_data.get("transcript", "").strip()
+    match_score = max(0, min(100, int(ai_data.get("match_score", 0))))
+    feedback = ai_data.get("feedback", "No feedback.")
+    emotion = ai_data.get("emotion", "neutral").lower()
+    emotion_score = max(0, min(100, int(ai_data.get("emotion_score", 0))))
+    
+    # CALCULATE PACE
+    wpm, pace_label, actual_duration = _compute_pace(_count_words(transcript), int(duration_seconds or 0))
+    
+    return {
+        "transcript": transcript,
+        "match_score": match_score,
+        "feedback": feedback,
+        "emotion": emotion,
+        "emotion_score": emotion_score,
+        "pace_wpm": wpm,
+        "pace_label": pace_label,
+        "duration_seconds": actual_duration,
+        "raw_response_file": raw_response_file
+    }
+
+
+def _result_from_cache(video_path: str, digest: str, question_text: str, duration_seconds: int):
+    """Result for an already-analyzed clip, or None on a cache miss (blocking; run via asyncio.to_thread)."""
+    cached = result_cache.get(digest, question_text)
+    if not cached:
+        return None
+    raw_file = _save_raw_response(video_path, cached["raw_response"])
+    return _build_result(cached["ai_data"], duration_seconds, raw_file)
+
+
+def _store_result(video_path: str, digest: str, question_text: str, ai_data: dict,
+                  raw_response: str, duration_seconds: int) -> dict:
+    """Build the result, keep the raw response and cache the answer (blocking; run via asyncio.to_thread)."""
+    result = _build_result(ai_data, duration_seconds, _save_raw_response(video_path, raw_response))
+    result_cache.put(digest, question_text, ai_data, raw_response)
+    return result
+
+
+# --- UNIFIED AI ANALYSIS (generate call retried in _generate_with_retry, queue handles job-level retry) ---
+async def analyze_video_with_gemini(video_path: str, question_text: str, duration_seconds: int = 0,
+                                    video_sha256: str = "") -> dict:
+    """
+    Unified API call: ONE request gets transcript + score + emotion + pace.
+    video_sha256: digest computed at upload time; the file is only re-hashed when it is missing.
+    
+    Returns dict with transcript, match_score, feedback, emotion, emotion_score, pace_wpm, pace_label.
+    """
+    logger.info(f"[AI] Starting unified analysis for: {os.path.basename(video_path)}")
+    
+    raw_response = ""
+    
+    try:
+        # Identical clip already analyzed for this question -> reuse, only pace is recomputed
+        digest = video_sha256 or await asyncio.to_thread(result_cache.video_digest, video_path)
+        cached = await asyncio.to_thread(_result_from_cache, video_path, digest, question_text, duration_seconds)
+        if cached:
+            logger.info(f"[AI] ♻️ Cache hit for {os.path.basename(video_path)}")
+            return cached
         
-        response = model.generate_content([video_file, prompt_text])
-        raw_response = response.text
-        logger.info(f"[AI] Response: {raw_response[:400]}")
+        # STEP 1: UPLOAD VIDEO
+        logger.info(f"[AI] Uploading video...")
+        # The SDK has no async upload/get_file, so keep them off the event loop
+        video_file = await asyncio.to_thread(_upload_video, video_path)
+        video_file = await _await_processed(video_file)
         
-        # STEP 3: PARSE JSON
-        json_text = clean_json_string(raw_response)
-        ai_data = json.loads(json_text)
+        if video_file.state.name == "FAILED":
+            raise ResourceExhausted("Google API failed to process video file")
         
-        # Extract fields
-        transcript = ai_data.get("transcript", "").strip()
-        match_score = max(0, min(100, int(ai_data.get("match_score", 0))))
-        feedback = ai_data.get("feedback", "No feedback.")
-        emotion = ai_data.get("emotion", "neutral").lower()
-        emotion_score = max(0, min(100, int(ai_data.get("emotion_score", 0))))
+        # STEP 2: SEND UNIFIED PROMPT
+        logger.info("[AI] Analyzing (Transcript + Score + Emotion)...")
         
-        # STEP 4: CALCULATE PACE
-        words = transcript.split() if transcript else []
-        word_count = len(words)
+        prompt_text = _question_prompt(question_text)
         
-        if duration_seconds and duration_seconds > 0:
-            actual_duration = max(1, int(duration_seconds))
-        else:
-            actual_duration = max(1, int((word_count / 140.0) * 60.0)) if word_count > 0 else 1
+        response = await _generate_with_retry(_MODEL, [video_file, prompt_text])
+        raw_response = response.text
+        logger.info(f"[AI] Response: {raw_response[:400]}")
         
-        wpm = int((word_count / actual_duration) * 60) if actual_duration > 0 else 0
-        pace_label = "slow" if wpm < 90 else ("normal" if wpm <= 150 else "fast")
+        # STEP 3: PARSE JSON
+        ai_data = orjson.loads(raw_response)
         
-        logger.info(f"[AI] ✅ {wpm}WPM, {emotion}, score={match_score}")
+        result = await asyncio.to_thread(_store_result, video_path, digest, question_text,
+                                         ai_data, raw_response, duration_seconds)
         
-        # Cleanup
-        try:
-            video_file.delete()
-        except:
-            pass
+        logger.info(f"[AI] ✅ {result['pace_wpm']}WPM, {result['emotion']}, score={result['match_score']}")
         
-        return {
-            "transcript": transcript,
-            "match_score": match_score,
-            "feedback": feedback,
-            "emotion": emotion,
-            "emotion_score": emotion_score,
-            "pace_wpm": wpm,
-            "pace_label": pace_label,
-            "duration_seconds": actual_duration,
-            "raw_response": raw_response
-        }
+        # Cleanup (fire-and-forget, nobody waits on the delete)
+        _delete_uploaded(video_file)
         
-    except json.JSONDecodeError as e:
-        logger.error(f"[AI] JSON error: {raw_response[:400]}")
+        return result
+        
+    except orjson.JSONDecodeError as e:
+        logger.error(f"[AI] JSON error ({e}): {raw_response[:400]}")
         raise
     except Exception as e:
         logger.error(f"[AI] Failed: {e}")
         raise
 
 
-def process_job_from_queue(job):
-    """Process job from queue: Upload video, analyze, save results."""
+async def _job_digest(job) -> str:
+    """Upload-time sha256 of the job's video, hashing the file only if it was not recorded."""
+    if job.video_sha256:
+        return job.video_sha256
+    return await asyncio.to_thread(result_cache.video_digest, job.video_path)
+
+
+async def analyze_videos_batch(jobs, durations) -> list:
+    """
+    Batched variant of analyze_video_with_gemini: several videos, ONE request.
+    Videos already in the result cache are answered from it and left out of the request.
+    
+    Returns one result dict per job (same order), or None for a video the
+    response had no usable entry for.
+    """
+    logger.info(f"[AI] Starting batch analysis for {len(jobs)} videos")
+    
+    digests = await asyncio.gather(*(
+        _job_digest(job) for job in jobs
+    ))
+    results = list(await asyncio.gather(*(
+        asyncio.to_thread(_result_from_cache, job.video_path, digest, job.question_text, durations[i])
+        for i, (job, digest) in enumerate(zip(jobs, digests))
+    )))
+    pending = []
+    for i, job in enumerate(jobs):
+        if results[i]:
+            logger.info(f"[AI] ♻️ Cache hit for {os.path.basename(job.video_path)}")
+        else:
+            pending.append(i)
+    
+    if not pending:
+        return results
+    
+    items, raw_response = await _request_batch([jobs[i] for i in pending])
+    stored = await asyncio.gather(*(
+        asyncio.to_thread(_store_result, jobs[i].video_path, digests[i], jobs[i].question_text,
+                          items[n], raw_response, durations[i])
+        for n, i in enumerate(pending)
+    ), return_exceptions=True)
+    for n, (i, result) in enumerate(zip(pending, stored)):
+        if isinstance(result, Exception):
+            logger.warning(f"[AI] Batch entry {n + 1} unusable: {result}")
+        else:
+            results[i] = result
+    
+    return results
+
+
+async def _request_batch(jobs):
+    """Upload several videos and analyze them in one request; returns (items, raw_response)."""
+    raw_response = ""
+    
     try:
-        logger.info(f"[Queue] Processing: {job.job_id}")
-        analysis_queue.mark_processing(job)
+        # STEP 1: UPLOAD ALL VIDEOS IN PARALLEL
+        uploads = await asyncio.gather(*(
+            asyncio.to_thread(_upload_video, job.video_path) for job in jobs
+        ))
+        video_files = await asyncio.gather(*(_await_processed(vf) for vf in uploads))
         
-        # Get duration from meta.json
-        duration_seconds = 0
-        try:
-            metadata_path = os.path.join(job.folder, 'meta.json')
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                str_idx = str(job.question_index)
-                if str_idx in metadata.get('receivedQuestions', {}):
-                    duration_seconds = metadata['receivedQuestions'][str_idx].get('durationSeconds', 0) or 0
-        except Exception as e:
-            logger.warning(f"[Queue] Could not read duration: {e}")
+        if any(vf.state.name == "FAILED" for vf in video_files):
+            raise ResourceExhausted("Google API failed to process video file")
         
-        # Call Gemini API
-        result = analyze_video_with_gemini(
-            video_path=job.video_path,
-            question_text=job.question_text,
-            duration_seconds=duration_seconds
+        # STEP 2: ONE PROMPT FOR ALL VIDEOS
+        logger.info("[AI] Analyzing batch (Transcript + Score + Emotion)...")
+        
+        contents = []
+        for i, (job, video_file) in enumerate(zip(jobs, video_files)):
+            contents += [f'Video {i + 1} answers the question: "{job.question_text}"', video_file]
+        contents.append(
+            f"Analyze each of the {len(jobs)} videos above independently, applying your instructions "
+            "to each one against the question given for that video. "
+            "Never carry words from one video into another. "
+            f"Return a JSON array of {len(jobs)} objects; element i corresponds to video i."
         )
         
-        # UPDATE meta.json
-        try:
-            metadata_path = os.path.join(job.folder, 'meta.json')
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                
-                str_idx = str(job.question_index)
-                if str_idx in metadata.get('receivedQuestions', {}):
-                    metadata['receivedQuestions'][str_idx].update({
-                        'status': 'done',
-                        'ai_done': True,
-                        'transcript_text': result['transcript'],
-                        'ai_match_score': result['match_score'],
-                        'ai_feedback': result['feedback'],
-                        'emotion': result['emotion'],
-                        'emotion_score': result['emotion_score'],
-                        'pace_wpm': result['pace_wpm'],
-                        'pace_label': result['pace_label']
-                    })
-                
-                with open(metadata_path, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, indent=4, ensure_ascii=False)
-                logger.info(f"[Queue] ✅ meta.json updated for Q{job.question_index + 1}")
-                
-                # --- NEW: CREATE Q_TRANSCRIPT.TXT FILE ---
-                try:
-                    q_num = job.question_index + 1
-                    transcript_file_path = os.path.join(job.folder, f'Q{q_num}_transcript.txt')
-                    
-                    # Format transcript file content
-                    transcript_content = f"""--- Q{q_num} ---
-Question: {job.question_text}
-Match Score: {result['match_score']}/100
-Feedback: {result['feedback']}
---- Transcript ---
-{result['transcript']}
-"""
-                    
-                    with open(transcript_file_path, 'w', encoding='utf-8') as f:
-                        f.write(transcript_content)
-                    
-                    logger.info(f"[Queue] ✅ Q{q_num}_transcript.txt created")
-                except Exception as e:
-                    logger.error(f"[Queue] Error creating transcript file: {e}")
-        except Exception as e:
-            logger.error(f"[Queue] Error updating meta.json: {e}")
+        response = await _generate_with_retry(_MODEL, contents, generation_config=_BATCH_CONFIG)
+        raw_response = response.text
+        logger.info(f"[AI] Batch response: {raw_response[:400]}")
         
-        # UPDATE FIRESTORE
-        try:
-            if job.token and job.token != "session_token_placeholder":
-                from server.api.firebase_setup import get_firestore_client
-                db = get_firestore_client()
-                
-                if db:
-                    session_ref = db.collection("sessions").document(job.token)
-                    session_doc = session_ref.get()
-                    
-                    if not session_doc.exists:
-                        logger.warning(f"[Queue] Session {job.token} doesn't exist, skipping Firestore")
-                    else:
-                        session_ref.update({
-                            f'q{job.question_index + 1}_ai_status': 'done',
-                            f'q{job.question_index + 1}_ai_transcript': result['transcript'],
-                            f'q{job.question_index + 1}_ai_score': result['match_score'],
-                            f'q{job.question_index + 1}_ai_feedback': result['feedback'],
-                            f'q{job.question_index + 1}_emotion': result['emotion'],
-                            f'q{job.question_index + 1}_emotion_score': result['emotion_score'],
-                            f'q{job.question_index + 1}_pace_wpm': result['pace_wpm'],
-                            f'q{job.question_index + 1}_pace_label': result['pace_label']
-                        })
-                        logger.info(f"[Queue] ✅ Firestore updated for Q{job.question_index + 1}")
-        except Exception as e:
-            logger.warning(f"[Queue] Firestore error (token={job.token}): {e}")
+        # STEP 3: PARSE JSON ARRAY
+        items = orjson.loads(raw_response)
+        if not isinstance(items, list):
+            raise ValueError("Batch response is not a JSON array")
         
-        analysis_queue.mark_success(job, result)
-        logger.info(f"✅ [Queue] Job {job.job_id} SUCCESS")
+        # Cleanup (fire-and-forget, nobody waits on the delete)
+        for video_file in video_files:
+            _delete_uploaded(video_file)
+        
+        # Pad a short array so every job gets an entry (None -> unusable)
+        return items + [None] * (len(jobs) - len(items)), raw_response
         
+    except orjson.JSONDecodeError as e:
+        logger.error(f"[AI] JSON error ({e}): {raw_response[:400]}")
+        raise
     except Exception as e:
-        error_msg = str(e)
-        logger.error(f"❌ [Queue] Job {job.job_id} FAILED: {error_msg}")
-        analysis_queue.mark_failed(job, error_msg)
+        logger.error(f"[AI] Batch failed: {e}")
+        raise
 
 
-def safe_process_interview_answer(video_path, question_index, output_folder, 
-                                  question_text, token, db):
-    """Legacy: Direct processing without queue."""
+def _write_meta_result(folder: str, question_index: int, result: dict):
+    """Mark one question as analyzed in meta.json."""
     try:
-        logger.info(f"[Legacy] Processing Q{question_index + 1} directly")
-        
-        # Get duration
-        duration_seconds = 0
-        try:
-            metadata_path = os.path.join(output_folder, 'meta.json')
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                str_idx = str(question_index)
-                if str_idx in metadata.get('receivedQuestions', {}):
-                    duration_seconds = metadata['receivedQuestions'][str_idx].get('durationSeconds', 0) or 0
-        except Exception as e:
-            logger.warning(f"[Legacy] Could not read duration: {e}")
-        
-        # Analyze
-        result = analyze_video_with_gemini(
-            video_path=video_path,
-            question_text=question_text,
-            duration_seconds=duration_seconds
-        )
-        
-        # Update meta.json
-        metadata_path = os.path.join(output_folder, 'meta.json')
-        if os.path.exists(metadata_path):
-            with open(metadata_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+        metadata_path = os.path.join(folder, 'meta.json')
+        if not os.path.exists(metadata_path):
+            return
+        with meta_lock(metadata_path):
+            metadata = load_meta(metadata_path)
             
             str_idx = str(question_index)
             if str_idx in metadata.get('receivedQuestions', {}):
@@ -355,84 +481,165 @@ def safe_process_interview_answer(video_path, question_index, output_folder,
                     'pace_label': result['pace_label']
                 })
             
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=4, ensure_ascii=False)
-            
-            # --- NEW: CREATE Q_TRANSCRIPT.TXT FILE ---
-            try:
-                q_num = question_index + 1
-                transcript_file_path = os.path.join(output_folder, f'Q{q_num}_transcript.txt')
-                
-                # Format transcript file content
-                transcript_content = f"""--- Q{q_num} ---
-Question: {question_text}
-Match Score: {result['match_score']}/100
-Feedback: {result['feedback']}
---- Transcript ---
-{result['transcript']}
-"""
-                
-                with open(transcript_file_path, 'w', encoding='utf-8') as f:
-                    f.write(transcript_content)
-                
-                logger.info(f"[Legacy] ✅ Q{q_num}_transcript.txt created")
-            except Exception as e:
-                logger.error(f"[Legacy] Error creating transcript file: {e}")
+            save_meta(metadata_path, metadata)
+        logger.info(f"[AI] ✅ meta.json updated for Q{question_index + 1}")
+    except Exception as e:
+        logger.error(f"[AI] Error updating meta.json: {e}")
+
+
+def _write_transcript_file(folder: str, question_index: int, question_text: str, result: dict):
+    """Write the Qn_transcript.txt backup for one question."""
+    try:
+        q_num = question_index + 1
         
-        # Update Firestore
-        if db and token and token != "session_token_placeholder":
-            try:
-                session_doc = db.collection("sessions").document(token).get()
-                if session_doc.exists:
-                    db.collection("sessions").document(token).update({
-                        f'q{question_index + 1}_ai_status': 'done',
-                        f'q{question_index + 1}_ai_transcript': result['transcript'],
-                        f'q{question_index + 1}_ai_score': result['match_score'],
-                        f'q{question_index + 1}_ai_feedback': result['feedback'],
-                        f'q{question_index + 1}_emotion': result['emotion'],
-                        f'q{question_index + 1}_emotion_score': result['emotion_score'],
-                        f'q{question_index + 1}_pace_wpm': result['pace_wpm'],
-                        f'q{question_index + 1}_pace_label': result['pace_label']
-                    })
-            except Exception as e:
-                logger.warning(f"[Legacy] Firestore error: {e}")
+        # Format transcript file content
+        transcript_content = "\n".join([
+            f"--- Q{q_num} ---",
+            f"Question: {question_text}",
+            f"Match Score: {result['match_score']}/100",
+            f"Feedback: {result['feedback']}",
+            "--- Transcript ---",
+            result['transcript'],
+            ""
+        ])
         
-        logger.info(f"✅ [Legacy] Q{question_index + 1} SUCCESS")
+        Path(folder, f'Q{q_num}_transcript.txt').write_text(transcript_content, encoding='utf-8', newline='\n')
         
+        logger.info(f"[AI] ✅ Q{q_num}_transcript.txt created")
     except Exception as e:
-        error_msg = str(e)
-        logger.error(f"❌ [Legacy] Q{question_index + 1} FAILED: {error_msg}")
+        logger.error(f"[AI] Error creating transcript file: {e}")
+
+
+def _firestore_fields(question_index: int, result: dict) -> dict:
+    """Session-document fields holding one question's analysis."""
+    return {
+        f'q{question_index + 1}_ai_status': 'done',
+        f'q{question_index + 1}_ai_transcript': result['transcript'],
+        f'q{question_index + 1}_ai_score': result['match_score'],
+        f'q{question_index + 1}_ai_feedback': result['feedback'],
+        f'q{question_index + 1}_emotion': result['emotion'],
+        f'q{question_index + 1}_emotion_score': result['emotion_score'],
+        f'q{question_index + 1}_pace_wpm': result['pace_wpm'],
+        f'q{question_index + 1}_pace_label': result['pace_label']
+    }
+
+
+def _flush_firestore(token: str, items, db=None):
+    """
+    Copy analyses onto the Firestore session document.
+    items: list of (question_index, result). Several items are committed as
+    one WriteBatch (one RPC); a lone item is a plain update.
+    """
+    if not items or not token or token == "session_token_placeholder":
+        return
+    questions = [f"Q{question_index + 1}" for question_index, _ in items]
+    try:
+        if db is None:
+            from server.api.firebase_setup import get_firestore_client
+            db = get_firestore_client()
+        if not db:
+            return
         
-        # Write error to meta.json
-        try:
-            metadata_path = os.path.join(output_folder, 'meta.json')
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-                
-                str_idx = str(question_index)
-                if str_idx in metadata.get('receivedQuestions', {}):
-                    metadata['receivedQuestions'][str_idx].update({
-                        'status': 'ai_error',
-                        'ai_done': False,
-                        'transcript_text': f'AI Analysis Failed: {error_msg[:100]}',
-                        'debug_error': error_msg
-                    })
-                
-                with open(metadata_path, 'w', encoding='utf-8') as f:
-                    json.dump(metadata, f, indent=4, ensure_ascii=False)
-        except Exception as write_err:
-            logger.error(f"[Legacy] meta.json write error: {write_err}")
+        session_ref = db.collection("sessions").document(token)
+        session_doc = session_ref.get(field_paths=EXISTS_CHECK_FIELDS)
+        
+        if not session_doc.exists:
+            logger.warning(f"[AI] Session {token} doesn't exist, skipping Firestore")
+            return
+        
+        if len(items) == 1:
+            question_index, result = items[0]
+            session_ref.update(_firestore_fields(question_index, result))
+        else:
+            batch = db.batch()
+            for question_index, result in items:
+                batch.update(session_ref, _firestore_fields(question_index, result))
+            batch.commit()
+        logger.info(f"[AI] ✅ Firestore updated for {', '.join(questions)}")
+    except Exception as e:
+        logger.warning(f"[AI] Firestore error (token={token}): {e}")
+
+
+async def _run_writes(*calls):
+    """Run independent blocking writes concurrently on _IO_POOL; returns when all are done."""
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(loop.run_in_executor(_IO_POOL, fn, *args) for fn, *args in calls))
+
+
+async def _persist_results(folder: str, question_index: int, question_text: str, result: dict,
+                           token: str, db=None, firestore: bool = True):
+    """
+    Write one question's analysis to meta.json, Qn_transcript.txt and Firestore in parallel.
+    firestore=False leaves the Firestore update to the caller (see _flush_firestore).
+    """
+    writes = [
+        (_write_meta_result, folder, question_index, result),
+        (_write_transcript_file, folder, question_index, question_text, result),
+    ]
+    if firestore:
+        writes.append((_flush_firestore, token, [(question_index, result)], db))
+    await _run_writes(*writes)
+
+
+async def process_job_from_queue(job):
+    """Process job from queue: Upload video, analyze, save results."""
+    try:
+        logger.info(f"[Queue] Processing: {job.job_id}")
+        analysis_queue.mark_processing(job)
+        
+        # Call Gemini API (duration was captured at enqueue time)
+        result = await analyze_video_with_gemini(
+            video_path=job.video_path,
+            question_text=job.question_text,
+            duration_seconds=job.duration_seconds,
+            video_sha256=job.video_sha256
+        )
+        
+        await _persist_results(job.folder, job.question_index, job.question_text, result, job.token)
+        
+        analysis_queue.mark_success(job, result)
+        logger.info(f"✅ [Queue] Job {job.job_id} SUCCESS")
+        
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"❌ [Queue] Job {job.job_id} FAILED: {error_msg}")
+        analysis_queue.mark_failed(job, error_msg)
+
+
+async def process_jobs_batch(jobs):
+    """Process several ready jobs of one session with a single Gemini request."""
+    try:
+        logger.info(f"[Queue] Processing batch: {[job.job_id for job in jobs]}")
+        for job in jobs:
+            analysis_queue.mark_processing(job)
         
-        # Update Firestore with error
-        if db and token and token != "session_token_placeholder":
-            try:
-                session_doc = db.collection("sessions").document(token).get()
-                if session_doc.exists:
-                    db.collection("sessions").document(token).update({
-                        f'q{question_index + 1}_ai_status': 'error',
-                        f'q{question_index + 1}_ai_transcript': f'AI Analysis Failed: {error_msg[:100]}',
-                        f'q{question_index + 1}_ai_debug': error_msg[:1000]
-                    })
-            except Exception as e:
-                logger.warning(f"[Legacy] Firestore error on failure: {e}")
+        durations = [job.duration_seconds for job in jobs]
+        results = await analyze_videos_batch(jobs, durations)
+    except Exception as e:
+        error_msg = str(e)
+        logger.error(f"❌ [Queue] Batch FAILED: {error_msg}")
+        for job in jobs:
+            analysis_queue.mark_failed(job, error_msg)
+        return
+    
+    done = []
+    for job, result in zip(jobs, results):
+        if result is None:
+            analysis_queue.mark_failed(job, "Batch response had no valid entry for this video")
+        else:
+            done.append((job, result))
+    
+    # Local files per question; Firestore once for the whole session
+    await asyncio.gather(*(
+        _persist_results(job.folder, job.question_index, job.question_text, result,
+                         job.token, firestore=False)
+        for job, result in done
+    ))
+    if done:
+        await _run_writes(
+            (_flush_firestore, jobs[0].token, [(job.question_index, result) for job, result in done])
+        )
+    
+    for job, result in done:
+        analysis_queue.mark_success(job, result)
+        logger.info(f"✅ [Queue] Job {job.job_id} SUCCESS")
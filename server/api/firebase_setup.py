@@ -1,6 +1,11 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
+from google.cloud import firestore as gcloud_firestore
 import os
+import orjson
+import functools
+import random
+import threading
 import traceback
 
 # --- Configuration Constants ---
@@ -9,25 +14,36 @@ DEFAULT_SERVICE_ACCOUNT_KEY_PATH = os.path.join(os.path.dirname(__file__), 'fire
 # Allow overriding the path via environment variable for flexibility in different environments
 SERVICE_ACCOUNT_KEY_PATH = os.environ.get('FIREBASE_ADMIN_KEY_PATH', DEFAULT_SERVICE_ACCOUNT_KEY_PATH)
 
-# --- Global Database References ---
-db = None
+# Number of Firestore clients to spread calls over; each owns its own gRPC channel
+FIRESTORE_CLIENT_COUNT = max(1, int(os.environ.get('FIRESTORE_CLIENT_COUNT', '4')))
+
+# --- Client Pool ---
+# _client_pool() is lru_cached; the lock makes the one-time initialization atomic
+_init_lock = threading.Lock()
 
 def initialize_firebase():
-    """Initializes the Firebase Admin SDK and sets up the Firestore client."""
-    global db
+    """
+    Initializes the Firebase Admin SDK and returns a Firestore client (None on failure).
+    Use get_firestore_client() instead of calling this directly.
+    """
+    # Already initialized (e.g. a concurrent first call won the race)
+    try:
+        firebase_admin.get_app()
+        return firestore.client()
+    except ValueError:
+        pass
     
     # First, allow passing raw credentials via env var (useful for CI or containerized deployments)
     print(f"Firebase setup: using key path: {SERVICE_ACCOUNT_KEY_PATH}")
     raw_creds = os.environ.get('FIREBASE_ADMIN_CREDENTIALS')
     if raw_creds:
         try:
-            import json
-            cred_dict = json.loads(raw_creds)
+            cred_dict = orjson.loads(raw_creds)
             cred = credentials.Certificate(cred_dict)
             firebase_admin.initialize_app(cred)
             db = firestore.client()
             print("Firebase Admin SDK and Firestore initialized from FIREBASE_ADMIN_CREDENTIALS env var.")
-            return
+            return db
         except Exception as e:
             print(f"ERROR: Failed to initialize Firebase from FIREBASE_ADMIN_CREDENTIALS: {e}")
             traceback.print_exc()
@@ -42,7 +58,7 @@ def initialize_firebase():
         print("="*80)
         # We can stop initialization here, but we will proceed with a None db handle
         # so the server can still start for other network testing.
-        return
+        return None
     try:
         # Load credentials from the specified JSON file
         cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH)
@@ -59,16 +75,85 @@ def initialize_firebase():
         # Get a reference to the Firestore client
         db = firestore.client()
         print("Firebase Admin SDK and Firestore successfully initialized from key file.")
+        return db
 
     except Exception as e:
         print(f"FATAL ERROR initializing Firebase: {e}")
         traceback.print_exc()
-        db = None # Ensure db is None if initialization failed
+        return None # No client if initialization failed
+
+@functools.lru_cache(maxsize=1)
+def _client_pool():
+    """
+    Firestore clients for the default app (empty tuple if Firebase could not be initialized).
+    firestore.client() caches one client per app, so the extra clients are built
+    directly with the app's credentials, the same way firebase_admin builds its own.
+    """
+    with _init_lock:
+        db = initialize_firebase()
+    if db is None:
+        return ()
+
+    clients = [db]
+    try:
+        app = firebase_admin.get_app()
+        for _ in range(FIRESTORE_CLIENT_COUNT - 1):
+            clients.append(gcloud_firestore.Client(
+                credentials=app.credential.get_credential(),
+                project=db.project
+            ))
+    except Exception as e:
+        print(f"Could not create extra Firestore clients, using one: {e}")
+    return tuple(clients)
+
 
 def get_firestore_client():
-    """Returns the initialized Firestore client."""
-    # Ensure initialization happens only once
+    """
+    Returns one Firestore client from the pool (None if Firebase could not be initialized).
+    Calls are spread over several gRPC channels instead of contending on one.
+    """
+    clients = _client_pool()
+    return random.choice(clients) if clients else None
+
+
+@functools.lru_cache(maxsize=1)
+def get_async_firestore_client():
+    """
+    Returns the AsyncClient singleton for request handlers (None if Firebase could not be initialized).
+    Its grpc.aio channel runs on the server's event loop, so endpoints await Firestore
+    directly. The queue worker's result flush runs on ai_service_v2's _IO_POOL threads
+    and keeps using the blocking get_firestore_client().
+    """
+    if not _client_pool():
+        return None
+    try:
+        return firestore_async.client()
+    except Exception as e:
+        print(f"ERROR: Failed to create async Firestore client: {e}")
+        traceback.print_exc()
+        return None
+
+
+async def warm_async_firestore():
+    """Warm-up read on the async client, from the event loop that will use it."""
+    db = get_async_firestore_client()
     if db is None:
-        initialize_firebase()
-        
-    return db
\ No newline at end of file
+        return
+    try:
+        await db.collection('_warmup').document('warm').get()
+    except Exception as e:
+        print(f"Async Firestore warm-up failed (continuing): {e}")
+
+
+def warm_firestore():
+    """
+    Issue one real read per pooled client so the gRPC channels, auth token and protobuf descriptors
+    are set up at startup instead of on the first user request.
+    """
+    for db in _client_pool():
+        try:
+            db.collection('_warmup').document('warm').get()
+        except Exception as e:
+            print(f"Firestore warm-up failed (continuing): {e}")
+            return
+    print("Firestore connections warmed up.")
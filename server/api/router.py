@@ -1,15 +1,21 @@
-import pytz
 from unidecode import unidecode
-from datetime import datetime
-from typing import Dict, Any, List, Optional
-from fastapi import APIRouter, HTTPException, status, Form, File, UploadFile, BackgroundTasks
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from functools import lru_cache
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import quote
+from typing import Dict, Any, List, NamedTuple, Optional
+from fastapi import APIRouter, HTTPException, status, Form, File, UploadFile, Depends
 from pydantic import BaseModel, Field
 import os # For file system operations
-import json # For handling metadata files
+import re # For sanitizing folder names
 import time # For simulating processing time (keep for sync fallbacks)
 import asyncio # Use asyncio.sleep in async helpers
+import contextlib
+import logging # Log records go through the queue handler installed in main.py
 
-from server.api.firebase_setup import get_firestore_client
+from server.api.firebase_setup import get_async_firestore_client
 # 🎯 BƯỚC 1: Mở rộng Import Models
 from server.api.models import (
     TokenVerificationRequest,
@@ -17,14 +23,40 @@ from server.api.models import (
 )
 
 import uuid # For generating unique IDs
+import secrets # For interview tokens (OS CSPRNG)
+import hashlib # For per-upload sha256 (computed while streaming)
+
+from server.job_queue import analysis_queue, JobStatus, QueueFullError
+from server.meta_store import (
+    load_meta, save_meta, meta_lock, record_upload
+)
+from firebase_admin import firestore_async
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
+logger = logging.getLogger(__name__)
 
-from server.ai_service_v2 import safe_process_interview_answer
-from server.job_queue import analysis_queue, JobStatus
 # --- CONFIGURATION ---
 # Mandatory timezone setup for folder naming (Asia/Bangkok)
-ASIA_BANGKOK = pytz.timezone('Asia/Bangkok')
+ASIA_BANGKOK_NAME = 'Asia/Bangkok'
+ASIA_BANGKOK = ZoneInfo(ASIA_BANGKOK_NAME)
 # Base directory where all session videos will be stored
-UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
+# Frontend origin used in the shareable interviewee link (read once at import)
+FRONTEND_BASE_URL = os.getenv("FRONTEND_BASE_URL", "http://localhost:3000").rstrip('/')
+UPLOAD_PATH = Path(__file__).resolve().parent.parent / 'uploads'
+_UPLOAD_REALPATH = os.path.realpath(UPLOAD_PATH)
+# Chunk size used when copying uploaded videos to disk
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+# How long a session folder that exists is trusted without re-checking the disk
+FOLDER_CACHE_TTL = 300  # seconds
+FOLDER_CACHE_SIZE = 1024  # folders
+_known_folders: "OrderedDict[str, float]" = OrderedDict()  # folder path -> expires_at
+# questionsSelected per session token, so uploads without questionText read Firestore once per session
+QUESTIONS_CACHE_TTL = 3600  # seconds
+QUESTIONS_CACHE_SIZE = 1024  # sessions
+_questions_cache: "OrderedDict[str, tuple]" = OrderedDict()  # token -> (expires_at, questions)
+_questions_cache_stats = {'memory': 0, 'meta': 0, 'firestore': 0}  # where lookups were answered
+# Field masks: fetch (and to_dict) only the session fields each endpoint reads
+SESSION_CHECK_FIELDS = ['status', 'interviewee_name', 'interviewee_name_lc']
+QUESTION_TEXT_FIELDS = ['questionsSelected', 'metadata_initial.questionsSelected']
 
 # Initialize the main router for all API endpoints
 api_router = APIRouter(
@@ -75,53 +107,72 @@ class ReviewSubmission(BaseModel):
     comment: str = Field(..., description="Text feedback.")
 # -------------------------
 
+def require_firestore() -> firestore_async.AsyncClient:
+    """FastAPI dependency: the async Firestore client, or 503 before the endpoint body runs."""
+    db = get_async_firestore_client()
+    if db is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database connection error.")
+    return db
+
+
 # --- 1. POST /api/verify-token (MANDATORY SERVER VALIDATION) ---
 
+def _require_pending_session(session_data, token: str, user_name: str) -> Dict[str, Any]:
+    """
+    Checks a session snapshot: it must exist, be 'pending' and belong to user_name.
+    Raises the matching HTTPException otherwise; returns the session dict.
+    """
+    if not session_data.exists:
+        # Mandatory check: Token not found
+        logger.warning("[verify_token] Token '%s' not found in Firestore.", token)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token.")
+
+    session = session_data.to_dict()
+    
+    if session.get('status') != 'pending':
+        # Check if the session is still available
+        logger.warning("[verify_token] Session status is '%s', not 'pending'.", session.get('status'))
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Session is already completed or inactive.")
+        
+    # interviewee_name_lc is stored lowercased at creation; older sessions fall back to interviewee_name
+    stored_name_lc = session.get('interviewee_name_lc') or (session.get('interviewee_name') or '').lower()
+    if stored_name_lc != user_name.lower():
+        # Mandatory check: Name must match the record tied to the token
+        logger.warning("[verify_token] Name mismatch: stored='%s', provided='%s'", session.get('interviewee_name'), user_name)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token valid, but name mismatch. Check spelling.")
+
+    return session
+
+
 @api_router.post("/verify-token", response_model=OkResponse, status_code=status.HTTP_200_OK)
-async def verify_token(request: TokenVerificationRequest):
+async def verify_token(request: TokenVerificationRequest, db: firestore_async.AsyncClient = Depends(require_firestore)):
     """
     Verifies the existence and validity of the interviewee's token and name in Firestore.
     A valid token must match a 'pending' session document.
     """
-    db = get_firestore_client()
-    if not db:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database connection error.")
-
     try:
         token = request.token.strip()
         user_name = request.user_name.strip()
         
-        print(f"[verify_token] Looking up token: {token}, user_name: {user_name}")
+        logger.debug("[verify_token] Looking up token: %s, user_name: %s", token, user_name)
         session_doc_ref = db.collection("sessions").document(token)
-        session_data = session_doc_ref.get()
+        session_data = await session_doc_ref.get(field_paths=SESSION_CHECK_FIELDS)
 
-        if not session_data.exists:
-            # Mandatory check: Token not found
-            print(f"[verify_token] Token '{token}' not found in Firestore.")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token.")
-
-        session = session_data.to_dict()
-        
-        if session.get('status') != 'pending':
-            # Check if the session is still available
-            print(f"[verify_token] Session status is '{session.get('status')}', not 'pending'.")
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Session is already completed or inactive.")
-            
-        if session.get('interviewee_name').lower() != user_name.lower():
-            # Mandatory check: Name must match the record tied to the token
-            print(f"[verify_token] Name mismatch: stored='{session.get('interviewee_name')}', provided='{user_name}'")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token valid, but name mismatch. Check spelling.")
+        _require_pending_session(session_data, token, user_name)
 
         return OkResponse(ok=True)
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error during token verification: {e}")
+        logger.error("Error during token verification: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server error during verification.")
 
 # --- Helper Function for Folder Naming ---
 
+_UNSAFE_NAME_CHARS = re.compile(r'[^a-z0-9_]+')
+
+@lru_cache(maxsize=1024)
 def sanitize_name_for_filesystem(name: str) -> str:
     """Sanitizes a name into the 'ten_user' part of the folder name."""
     # 1. Transliterate (e.g., convert 'á' to 'a') using unidecode
@@ -129,34 +180,52 @@ def sanitize_name_for_filesystem(name: str) -> str:
     # 2. Replace spaces with underscores, and convert to lowercase
     sanitized = sanitized.strip().lower().replace(" ", "_")
     # 3. Remove non-alphanumeric characters (keeping only letters, numbers, and underscores)
-    sanitized = ''.join(c for c in sanitized if c.isalnum() or c == '_')
-    return sanitized
+    #    unidecode output is ASCII, so one precompiled regex pass covers it
+    return _UNSAFE_NAME_CHARS.sub('', sanitized)
+
+# Per-session constant part of the initial metadata
+_METADATA_TEMPLATE = {
+    "timeZone": ASIA_BANGKOK_NAME,
+    "status": "active",
+}
+
+def _make_initial_metadata(session_id: str, user_name: str, token: str, folder_name: str, uploaded_at: str) -> Dict[str, Any]:
+    """Initial session metadata (Firestore metadata_initial and meta.json)."""
+    return {
+        **_METADATA_TEMPLATE,
+        "session_id": session_id,
+        "userName": user_name,
+        "token": token,
+        "folderName": folder_name,
+        "uploadedAt": uploaded_at, # ISO 8601 timestamp
+        "receivedQuestions": {}, # Key=QIndex, Value=filename/status (fresh per session)
+        "questionsSelected": [] # To be populated by the client
+    }
 
 # --- 2. POST /api/session/start (MANDATORY FOLDER CREATION) ---
 
 @api_router.post("/session/start", response_model=SessionFolderResponse, status_code=status.HTTP_200_OK)
-async def session_start(request: TokenVerificationRequest):
+@api_router.post("/session/verify-and-start", response_model=SessionFolderResponse, status_code=status.HTTP_200_OK)
+async def session_start(request: TokenVerificationRequest, db: firestore_async.AsyncClient = Depends(require_firestore)):
     """
     Starts the interview session, generates the mandatory folder name (DD_MM_YYYY_HH_mm_ten_user/), 
     and updates the session status in Firestore.
+    Performs the same checks as /verify-token on the one document read, so clients
+    can call /session/verify-and-start directly and skip the separate verification round trip.
     """
-    db = get_firestore_client()
-    if not db:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database connection error.")
-
     token = request.token.strip()
     user_name = request.user_name.strip()
     session_doc_ref = db.collection("sessions").document(token)
     
-    # Check if the token is valid, pending, and the name matches
-    session_data = session_doc_ref.get()
-    if not session_data.exists or session_data.to_dict().get('status') != 'pending' or session_data.to_dict().get('interviewee_name').lower() != user_name.lower():
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token validation failed. Cannot start session.")
+    # Check if the token is valid, pending, and the name matches (one masked read, one to_dict)
+    session_data = await session_doc_ref.get(field_paths=SESSION_CHECK_FIELDS)
+    _require_pending_session(session_data, token, user_name)
 
     # 1. Generate the mandatory folder name components
     now_bangkok = datetime.now(ASIA_BANGKOK)
     # Format: DD_MM_YYYY_HH_mm
     timestamp_str = now_bangkok.strftime("%d_%m_%Y_%H_%M")
+    start_time = now_bangkok.isoformat()
     
     sanitized_user_name = sanitize_name_for_filesystem(user_name)
     
@@ -168,103 +237,226 @@ async def session_start(request: TokenVerificationRequest):
         session_id = str(uuid.uuid4())
         
         # Initial metadata structure (will be saved as meta.json later)
-        initial_metadata_data = {
-            "session_id": session_id,
-            "userName": user_name,
-            "token": token,
-            "folderName": folder_name,
-            "uploadedAt": now_bangkok.isoformat(), # ISO 8601 timestamp
-            "timeZone": str(ASIA_BANGKOK),
-            "status": "active",
-            "receivedQuestions": {}, # Key=QIndex, Value=filename/status
-            "questionsSelected": [] # To be populated by the client
-        }
+        initial_metadata_data = _make_initial_metadata(
+            session_id, user_name, token, folder_name, start_time
+        )
         
-        # Update session status, folder name, and store initial metadata
-        session_doc_ref.update({
+        # Update session status, folder name, and store initial metadata.
+        # Precondition: the document is unchanged since the pending check above, so two
+        # concurrent starts of the same token cannot both succeed (no transaction round trips).
+        await session_doc_ref.update({
             "status": "active",
             "folder_name": folder_name,
-            "start_time": now_bangkok.isoformat(),
+            "start_time": start_time,
             "metadata_initial": initial_metadata_data
-        })
+        }, option=db.write_option(last_update_time=session_data.update_time))
         
+    except FailedPrecondition:
+        logger.warning("[session_start] Session %s changed since it was checked (started twice?)", token)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Session is already completed or inactive.")
     except Exception as e:
-        print(f"Error updating session status in Firestore: {e}")
+        logger.error("Error updating session status in Firestore: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to finalize session start.")
 
     # 3. Return the generated folder name (Network requirement)
     # Ensure uploads base directory exists and create the session folder with initial meta.json
     try:
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        full_folder_path = os.path.join(UPLOAD_DIR, folder_name)
-        os.makedirs(full_folder_path, exist_ok=True)
+        full_folder_path = UPLOAD_PATH / folder_name
+        # parents=True also creates uploads/ on first use
+        full_folder_path.mkdir(parents=True, exist_ok=True)
 
         # Prepare initial metadata to be stored locally as meta.json
-        metadata_file_path = os.path.join(full_folder_path, 'meta.json')
-        file_metadata = initial_metadata_data.copy()
-        # Add total size and status fields expected by upload endpoint
-        file_metadata['videoSizeTotalMB'] = 0.0
-        file_metadata['status'] = 'active'
-
-        with open(metadata_file_path, 'w', encoding='utf-8') as f:
-            json.dump(file_metadata, f, indent=4, ensure_ascii=False)
+        metadata_file_path = str(full_folder_path / 'meta.json')
+        # Add the total size field expected by upload endpoint
+        file_metadata = {**initial_metadata_data, 'videoSizeTotalMB': 0.0}
+
+        # Ghi meta.json trong thread riêng để không chặn event loop
+        await asyncio.to_thread(save_meta, metadata_file_path, file_metadata)
     except Exception as e:
-        print(f"Failed to create session folder or write metadata: {e}")
+        logger.error("Failed to create session folder or write metadata: %s", e)
         # Do not block the creation of a session for disk errors, but log them
 
     return SessionFolderResponse(ok=True, folder=folder_name, session_id=session_id)
 
 # --- 3. POST /api/upload-one (MANDATORY PER-QUESTION UPLOAD) ---
 
+class SessionPaths(NamedTuple):
+    """Every path a request needs inside one session folder, joined once (str for the str-based helpers)."""
+    folder: str
+    video: str
+    meta: str
+
+
+def _session_paths(folder: str, question_index: int) -> SessionPaths:
+    """
+    Paths for a session folder name sent by the client and one question's video.
+    The name must be a single path component so it cannot point outside UPLOAD_PATH.
+    """
+    if not folder or Path(folder).name != folder or folder in ('.', '..'):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid session folder.")
+    folder_path = UPLOAD_PATH / folder
+    return SessionPaths(
+        folder=str(folder_path),
+        # Client gửi index 0, file lưu là Q1.webm -> cộng thêm 1
+        video=str(folder_path / f"Q{question_index + 1}.webm"),
+        meta=str(folder_path / 'meta.json'),
+    )
+
+
+def _meta_questions(metadata_file_path: str) -> list:
+    """questionsSelected stored in meta.json ([] if missing or not saved yet)."""
+    try:
+        qs = load_meta(metadata_file_path).get('questionsSelected')
+    except (OSError, ValueError):
+        return []
+    return qs if isinstance(qs, list) else []
+
+
+def _store_meta_questions(metadata_file_path: str, qs: list):
+    """Keep a copy of questionsSelected in meta.json so later lookups stay local."""
+    try:
+        with meta_lock(metadata_file_path):
+            metadata = load_meta(metadata_file_path)
+            metadata['questionsSelected'] = qs
+            save_meta(metadata_file_path, metadata)
+    except Exception as e:
+        logger.warning("[upload-one] Could not store questionsSelected in meta.json: %s", e)
+
+
+async def _session_questions(db, token: str, metadata_file_path: str) -> list:
+    """
+    questionsSelected of a session. The client writes it to Firestore right after
+    session start and never changes it, so once found it is kept in memory
+    (for QUESTIONS_CACHE_TTL) and in the session's meta.json (survives restarts).
+    Lookup order: memory -> meta.json -> Firestore.
+    """
+    now = time.monotonic()
+    cached = _questions_cache.get(token)
+    if cached and cached[0] > now:
+        _questions_cache.move_to_end(token)
+        _count_questions_lookup('memory')
+        return cached[1]
+
+    qs = await asyncio.to_thread(_meta_questions, metadata_file_path)
+    if qs:
+        _count_questions_lookup('meta')
+    else:
+        _count_questions_lookup('firestore')
+        session_doc = await db.collection('sessions').document(token).get(field_paths=QUESTION_TEXT_FIELDS)
+        if not session_doc.exists:
+            return []
+        sdata = session_doc.to_dict()
+        qs = sdata.get('questionsSelected') or sdata.get('metadata_initial', {}).get('questionsSelected')
+        if not isinstance(qs, list) or not qs:
+            return []  # Not saved yet: don't cache, the next upload looks again
+        await asyncio.to_thread(_store_meta_questions, metadata_file_path, qs)
+
+    _questions_cache[token] = (now + QUESTIONS_CACHE_TTL, qs)
+    _questions_cache.move_to_end(token)
+    while len(_questions_cache) > QUESTIONS_CACHE_SIZE:
+        _questions_cache.popitem(last=False)
+    return qs
+
+
+def _count_questions_lookup(source: str):
+    """Track where question lookups are answered, to confirm the cache hit-rate in debug logs."""
+    _questions_cache_stats[source] += 1
+    logger.debug("[upload-one] Question lookup served from %s (totals: %s)", source, _questions_cache_stats)
+
+
+def _session_folder_exists(full_folder_path: str) -> bool:
+    """
+    os.path.isdir, remembered for FOLDER_CACHE_TTL seconds once a folder is seen (misses are not cached).
+    At most FOLDER_CACHE_SIZE folders are kept (least recently used dropped first); an
+    expired entry is removed when it is looked up.
+    The folder is also resolved (symlinks included) and must stay inside UPLOAD_PATH; checked
+    once per cache period, in the same pass as the stat.
+    """
+    now = time.monotonic()
+    expires_at = _known_folders.get(full_folder_path)
+    if expires_at is not None:
+        if expires_at > now:
+            _known_folders.move_to_end(full_folder_path)
+            return True
+        del _known_folders[full_folder_path]
+    real = os.path.realpath(full_folder_path)
+    if os.path.commonpath([real, _UPLOAD_REALPATH]) != _UPLOAD_REALPATH or real == _UPLOAD_REALPATH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid session folder.")
+    if os.path.isdir(real):
+        _known_folders[full_folder_path] = now + FOLDER_CACHE_TTL
+        while len(_known_folders) > FOLDER_CACHE_SIZE:
+            _known_folders.popitem(last=False)
+        return True
+    return False
+
+
+def _save_upload(src, dst_path: str):
+    """
+    Copy a spooled upload to dst_path in UPLOAD_CHUNK_SIZE pieces through one reused
+    buffer, feeding sha256 as it goes (blocking; run via asyncio.to_thread).
+    Returns (size in bytes, sha256 hex digest).
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    buf = bytearray(UPLOAD_CHUNK_SIZE)
+    view = memoryview(buf)
+    src.seek(0)
+    with open(dst_path, 'wb') as dst:
+        while n := src.readinto(buf):
+            hasher.update(view[:n])
+            dst.write(view[:n])
+            size += n
+    return size, hasher.hexdigest()
+
+
 @api_router.post("/upload-one", status_code=status.HTTP_200_OK)
 async def upload_one(
-    background_tasks: BackgroundTasks,
     token: str = Form(...),
     folder: str = Form(...),
     questionIndex: int = Form(...),
     questionText: str = Form(None),
     durationSeconds: int = Form(None),     # <-- NEW: duration in seconds from frontend 
-    video: UploadFile = File(...)
+    video: UploadFile = File(...),
+    db: firestore_async.AsyncClient = Depends(require_firestore)
 ):
     """
     Handles the mandatory per-question video upload using multipart/form-data.
     Saves the video file and updates the session metadata.
     """
-    db = get_firestore_client()
-    if not db:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database connection error.")
-
-    # 1. Validate mandatory fields
+    # 1. Validate mandatory fields (cheap checks first, before any syscall or DB lookup)
     if not folder or questionIndex is None or not token:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing required form fields (token, folder, index).")
 
+    if video.content_type not in ["video/webm", "video/ogg"]:
+         raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Unsupported file type: {video.content_type}. Only video/webm accepted.")
+
     # 2. Define file paths and name
-    full_folder_path = os.path.join(UPLOAD_DIR, folder)
-    file_name = f"Q{questionIndex + 1}.webm"
-    full_file_path = os.path.join(full_folder_path, file_name)
+    paths = _session_paths(folder, questionIndex)
+    full_folder_path, full_file_path = paths.folder, paths.video
+    file_name = os.path.basename(full_file_path)
     
     # 3. Security and integrity checks
-    if not os.path.isdir(full_folder_path):
+    if not _session_folder_exists(full_folder_path):
         # This checks if the folder generated by session/start exists
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session folder not found. Start session first.")
-    
-    if video.content_type not in ["video/webm", "video/ogg"]:
-         raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=f"Unsupported file type: {video.content_type}. Only video/webm accepted.")
 
     # 4. Save the file to the local disk (Network I/O)
     try:
-        file_content = await video.read()
-        file_size_bytes = len(file_content)
-        
-        # Save the content to the file path
-        with open(full_file_path, "wb") as f:
-            f.write(file_content)
+        # The body is already spooled by Starlette: copy it in one worker thread
+        # (one thread hop per upload, not two per chunk), hashing on the way
+        file_size_bytes, video_sha256 = await asyncio.to_thread(_save_upload, video.file, full_file_path)
             
-        print(f"Successfully saved file: {full_file_path}")
+        logger.debug("Successfully saved file: %s", full_file_path)
         
     except Exception as e:
-        print(f"File write error: {e}")
+        logger.error("File write error: %s", e)
+        # Don't leave a truncated Qn.webm behind for retry-processing to pick up
+        with contextlib.suppress(OSError):
+            os.remove(full_file_path)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save video file on server.")
+    finally:
+        # Release the spooled temp copy now instead of after the response
+        await video.close()
        
     # 5. Prepare Data for AI (Logic lấy Text câu hỏi)
     # --- GIỮ NGUYÊN LOGIC CỦA BẠN NHƯNG GỌN GÀNG HƠN ĐỂ LẤY BIẾN question_text ---
@@ -274,23 +466,20 @@ async def upload_one(
     # Priority 1: Client provided text
     if questionText and str(questionText).strip():
         question_text = str(questionText).strip()
-        print(f"[upload-one] Using client-provided text for {question_label}")
+        logger.debug("[upload-one] Using client-provided text for %s", question_label)
     else:
-        # Priority 2: Firestore lookup (Giữ nguyên logic cũ của bạn)
+        # Priority 2: questionsSelected of this session (memory -> meta.json -> Firestore)
         try:
-            session_doc = db.collection('sessions').document(token).get()
-            if session_doc.exists:
-                sdata = session_doc.to_dict()
-                qs = sdata.get('questionsSelected') or sdata.get('metadata_initial', {}).get('questionsSelected')
-                if isinstance(qs, list) and len(qs) > int(questionIndex):
-                    candidate = qs[int(questionIndex)]
-                    if isinstance(candidate, dict):
-                        question_text = candidate.get('text') or candidate.get('question') or str(candidate)
-                    else:
-                        question_text = str(candidate)
-                    print(f"[upload-one] Found text in Firestore for {question_label}")
+            qs = await _session_questions(db, token, paths.meta)
+            if len(qs) > int(questionIndex):
+                candidate = qs[int(questionIndex)]
+                if isinstance(candidate, dict):
+                    question_text = candidate.get('text') or candidate.get('question') or str(candidate)
+                else:
+                    question_text = str(candidate)
+                logger.debug("[upload-one] Found text in session questions for %s", question_label)
         except Exception as e:
-            print(f"[upload-one] Firestore lookup error: {e}")
+            logger.warning("[upload-one] Firestore lookup error: %s", e)
 
     # Fallback if nothing found
     if not question_text:
@@ -299,72 +488,23 @@ async def upload_one(
     # 6. Update Metadata (INITIAL STATUS)
     # Thay vì lưu kết quả ngay, ta lưu trạng thái "Đang xử lý" (Processing)
     metadata_update_status = 'uploaded_processing_ai' # <--- TRẠNG THÁI MỚI
+    size_mb = round(file_size_bytes / (1024 * 1024), 2)
+    duration_value = int(durationSeconds) if durationSeconds is not None else 0
     
+    # meta.json is what the review page reads: write the entry now (under the meta lock)
     try:
-        metadata_file_path = os.path.join(full_folder_path, 'meta.json')
-        
-        # Load or Init Metadata
-        if os.path.exists(metadata_file_path):
-            # Try UTF-8 first (the expected format). On Windows, some editors may
-            # have written the file with a local code page (cp1252 / 'charmap')
-            # which can raise a UnicodeDecodeError. Attempt a graceful fallback
-            # — read using 'utf-8' and if that fails, try 'cp1252' and replace
-            # invalid characters to avoid crashing the upload path.
-            try:
-                with open(metadata_file_path, 'r', encoding='utf-8') as f:
-                    metadata = json.load(f)
-            except UnicodeDecodeError as ude:
-                print(f"[upload-one] meta.json UTF-8 decode failed: {ude}. Trying cp1252 fallback with replacement.")
-                try:
-                    with open(metadata_file_path, 'r', encoding='cp1252', errors='replace') as f:
-                        content = f.read()
-                    metadata = json.loads(content)
-                except Exception as e2:
-                    # If parsing still fails, start with a sensible default so we don't block the upload
-                    print(f"[upload-one] meta.json parse after fallback failed: {e2}. Using empty metadata object.")
-                    metadata = {"receivedQuestions": {}, "videoSizeTotalMB": 0}
-        else:
-            metadata = {"receivedQuestions": {}, "videoSizeTotalMB": 0}
-        
-        # Update entry
-        metadata['receivedQuestions'][str(questionIndex)] = {
+        await asyncio.to_thread(record_upload, paths.meta, questionIndex, {
             'filename': file_name,
             'status': metadata_update_status,
             'transcript_text': "Processing...", # Frontend sẽ hiện chữ này trong khi chờ
             'transcriptFile': None,
-            'sizeMB': round(file_size_bytes / (1024 * 1024), 2),
-            'uploadedAt': datetime.now(pytz.utc).isoformat(),
-            'durationSeconds': int(durationSeconds) if durationSeconds is not None else 0
-        }
-        
-        # Recalculate total size
-        total_size = sum(item['sizeMB'] for item in metadata['receivedQuestions'].values())
-        metadata['videoSizeTotalMB'] = total_size
-        
-        # Write to disk using UTF-8 and ensure_ascii=False so that unicode is preserved.
-        try:
-            with open(metadata_file_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=4, ensure_ascii=False)
-        except Exception as write_err:
-            # If writing fails for some reason, log it but continue processing to avoid blocking the upload flow
-            print(f"[upload-one] Failed to write meta.json (utf-8): {write_err}")
-            # Try a safe fallback write using 'cp1252' with replacements to at least persist something readable on Windows
-            try:
-                with open(metadata_file_path, 'w', encoding='cp1252', errors='replace') as f:
-                    json.dump(metadata, f, indent=4)
-                print("[upload-one] Wrote meta.json using cp1252 fallback with replacement.")
-            except Exception:
-                # Final fallback: we can't do much; the folder exists and the file might be unreadable.
-                print("[upload-one] Final fallback failed while writing meta.json. Metadata not persisted to disk.")
-
-        # Update Firestore (Optional - Dashboard Status)
-        # db.collection("sessions").document(token).update({
-        #    'status': f'q{questionIndex+1}_{metadata_update_status}',
-        #    'total_size_mb': total_size
-        # })
-        
+            'sizeMB': size_mb,
+            'uploadedAt': datetime.now(timezone.utc).isoformat(),
+            'durationSeconds': duration_value,
+            'sha256': video_sha256
+        })
     except Exception as e:
-        print(f"Metadata update error: {e}")
+        logger.error("[upload-one] Metadata update error: %s", e)
 
     # 7. ADD JOB TO QUEUE (Queue sẽ xử lý tự động)
     # Server trả về OK ngay lập tức, queue xử lý ngầm bên dưới
@@ -375,22 +515,21 @@ async def upload_one(
             question_index=questionIndex,
             question_text=question_text,
             video_path=full_file_path,
-            is_manual_retry=False
+            is_manual_retry=False,
+            duration_seconds=int(durationSeconds) if durationSeconds is not None else 0,
+            video_sha256=video_sha256
         )
-        print(f"[upload-one] Added job to queue: {job_id}")
-    except Exception as e:
-        print(f"[upload-one] Error adding job to queue: {e}")
-        # Fallback: Direct processing (legacy path)
-        background_tasks.add_task(
-            safe_process_interview_answer,
-            video_path=full_file_path,
-            question_index=questionIndex,
-            output_folder=full_folder_path,
-            question_text=question_text,
-            token=token,
-            db=db,
-            duration_seconds=int(durationSeconds) if durationSeconds is not None else None
+        logger.info("[upload-one] Added job to queue: %s", job_id)
+    except QueueFullError as e:
+        # Queue bounded on purpose: shed load instead of starting unbounded background work
+        logger.warning("[upload-one] %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy analyzing other answers. Please retry the upload shortly.",
+            headers={"Retry-After": str(analysis_queue.JOB_PROCESSING_INTERVAL)}
         )
+    except Exception as e:
+        logger.error("[upload-one] Error adding job to queue: %s", e)
 
     # 8. Success Response
     return {
@@ -402,31 +541,37 @@ async def upload_one(
 # --- 4. POST /api/retry-processing (MANUAL RETRY BUTTON) ---
 # Use the main `api_router` instance defined above
 @api_router.post("/retry-processing", status_code=status.HTTP_200_OK)
-async def retry_processing(
-    req: RetryRequest, 
-    background_tasks: BackgroundTasks
-):
+async def retry_processing(req: RetryRequest):
     """
     Endpoint kích hoạt lại AI Analysis cho một video cụ thể.
     Sử dụng file video đã lưu trên Firebase từ lần upload trước.
     """
     # 1. Tái tạo đường dẫn file (Logic này phải khớp với cách bạn lưu file)
-    # Sử dụng UPLOAD_DIR global (đã được define ở top của file)
-    full_folder_path = os.path.join(UPLOAD_DIR, req.folder)
-    
-    # Lưu ý: Client gửi index 0, file lưu là Q1.webm -> cộng thêm 1
-    file_name = f"Q{req.questionIndex + 1}.webm"
-    full_file_path = os.path.join(full_folder_path, file_name)
+    # Sử dụng UPLOAD_PATH global (đã được define ở top của file)
+    paths = _session_paths(req.folder, req.questionIndex)
+    full_folder_path, full_file_path = paths.folder, paths.video
 
     # 2. Kiểm tra file video có tồn tại không
     if not os.path.exists(full_file_path):
         raise HTTPException(status_code=404, detail="Original video file not found. Please re-upload.")
 
-    print(f"🔄 Manual Retry triggered for {req.folder} - Q{req.questionIndex + 1}")
+    logger.info("🔄 Manual Retry triggered for %s - Q%s", req.folder, req.questionIndex + 1)
 
     # 3. Add retry job to queue
     q_text = req.questionText if req.questionText else "Unknown Question (Retry)"
 
+    # Duration and sha256 recorded at upload time (pace if the job is re-created; the
+    # stored digest keys the result cache, so the video isn't read again to hash it)
+    duration_seconds = 0
+    video_sha256 = ""
+    try:
+        metadata = await asyncio.to_thread(load_meta, paths.meta)
+        q_meta = metadata.get('receivedQuestions', {}).get(str(req.questionIndex), {})
+        duration_seconds = q_meta.get('durationSeconds', 0) or 0
+        video_sha256 = q_meta.get('sha256') or ""
+    except Exception as e:
+        logger.warning("[retry-processing] Could not read duration from meta.json: %s", e)
+
     try:
         job_id = analysis_queue.add_job(
             token=req.token,
@@ -434,13 +579,15 @@ async def retry_processing(
             question_index=req.questionIndex,
             question_text=q_text,
             video_path=full_file_path,
-            is_manual_retry=True
+            is_manual_retry=True,
+            duration_seconds=duration_seconds,
+            video_sha256=video_sha256
         )
-        print(f"[retry-processing] Manual retry queued: {job_id}")
+        logger.info("[retry-processing] Manual retry queued: %s", job_id)
         
         # Get job to check status
         job = analysis_queue.get_job(job_id)
-        queue_position = len(analysis_queue.queue)
+        queue_position = analysis_queue.queue_size()
         
         return {
             "ok": True, 
@@ -448,85 +595,108 @@ async def retry_processing(
             "job_id": job_id,
             "queue_position": queue_position
         }
+    except QueueFullError as e:
+        logger.warning("[retry-processing] %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy analyzing other answers. Please retry shortly.",
+            headers={"Retry-After": str(analysis_queue.JOB_PROCESSING_INTERVAL)}
+        )
     except Exception as e:
-        print(f"[retry-processing] Error queuing retry: {e}")
+        logger.error("[retry-processing] Error queuing retry: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to queue retry: {str(e)}")
 
 # --- 5. POST /api/session/finish ---
 
+def _mark_meta_complete(metadata_file_path: str):
+    """
+    Set status='complete' in meta.json (blocking; run via asyncio.to_thread).
+    Skips the rewrite when there is nothing to change (e.g. the client retries finish).
+    """
+    with meta_lock(metadata_file_path):
+        metadata = load_meta(metadata_file_path)
+        if metadata.get('status') == 'complete':
+            return
+        metadata['status'] = 'complete'
+        save_meta(metadata_file_path, metadata)
+
+
 @api_router.post("/session/finish", response_model=OkResponse, status_code=status.HTTP_200_OK)
 async def session_finish(
     token: str = Form(...),
     folder: str = Form(...),
     questionsCount: int = Form(...),
+    db: firestore_async.AsyncClient = Depends(require_firestore),
 ):
     """
     Closes the session, marks the status as complete in Firestore, and locks the metadata file.
     """
-    db = get_firestore_client()
-    if not db:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database connection error.")
-
     try:
         # Update Firestore status
-        db.collection("sessions").document(token).update({
+        await db.collection("sessions").document(token).update({
             'status': 'complete',
             'questions_answered': questionsCount,
             'end_time': datetime.now(ASIA_BANGKOK).isoformat()
         })
         
         # Update local metadata file to mark the final status (optional but good practice)
-        full_folder_path = os.path.join(UPLOAD_DIR, folder)
-        metadata_file_path = os.path.join(full_folder_path, 'meta.json')
+        metadata_file_path = _session_paths(folder, 0).meta
         
         if os.path.exists(metadata_file_path):
-            # Đọc (read - 'r') CẦN THÊM encoding='utf-8'
-            with open(metadata_file_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-            
-            metadata['status'] = 'complete'
-            
-            # Ghi (write - 'w') CẦN THÊM encoding='utf-8' và ensure_ascii=False
-            with open(metadata_file_path, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=4, ensure_ascii=False)
+            await asyncio.to_thread(_mark_meta_complete, metadata_file_path)
         
         return OkResponse(ok=True)
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error finalizing session: {e}")
+        logger.error("Error finalizing session: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to finalize session.")
 
 # --- 5. POST /api/interviewer/create-session (TOKEN GENERATION) ---
 
+TOKEN_CREATE_ATTEMPTS = 3  # fresh tokens tried if one is already taken
+
+def _generate_session_token() -> str:
+    """
+    8-char token from 6 random bytes (48 bits) via secrets.token_urlsafe.
+    Base64 '-'/'_' are mapped to letters so the code stays easy to type.
+    """
+    return secrets.token_urlsafe(6).upper().replace('_', 'X').replace('-', 'Y')
+
+
 @api_router.post("/interviewer/create-session", response_model=SessionCreationResponse, status_code=status.HTTP_201_CREATED)
-async def create_new_session(request: InterviewerCreateSessionRequest):
+async def create_new_session(request: InterviewerCreateSessionRequest, db: firestore_async.AsyncClient = Depends(require_firestore)):
     """
     Interviewer function to create a new session, generating a unique token and setting 
     the status to 'pending'. This data is used by the Interviewee to log in.
     """
-    db = get_firestore_client()
-    if not db:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database connection error.")
-        
-    # Generate a unique, short, human-readable token (e.g., 8 alphanumeric chars)
-    # For robust security, UUID4 is better, but a simple 8-digit code can be used for ease of use.
-    # We will use the first 8 characters of a UUID for simplicity and uniqueness.
-    token = str(uuid.uuid4())[:8].upper()
     now_utc = datetime.utcnow().isoformat()
     
     new_session_data = {
         "interviewee_name": request.interviewee_name.strip(),
+        "interviewee_name_lc": request.interviewee_name.strip().lower(), # Precomputed for the login name check
         "interviewer_id": request.interviewer_id,
         "status": "pending", # Must be 'pending' for the interviewee to verify
         "created_at": now_utc,
-        "token": token,
     }
     
     try:
-        # Save the new session using the generated token as the document ID
-        db.collection("sessions").document(token).set(new_session_data)
+        # Save the new session using the generated token as the document ID.
+        # create() fails on an existing ID, so a token collision never overwrites another session.
+        for attempt in range(TOKEN_CREATE_ATTEMPTS):
+            # Generate a unique, short, human-readable token (8 uppercase alphanumeric chars)
+            token = _generate_session_token()
+            new_session_data["token"] = token
+            try:
+                await db.collection("sessions").document(token).create(new_session_data)
+                break
+            except AlreadyExists:
+                logger.warning("[create-session] Token %s already in use (attempt %s)", token, attempt + 1)
+        else:
+            raise RuntimeError("Could not allocate an unused session token")
         
         # Construct the URL the interviewer would share
-        session_url = f"http://localhost:3000/interviewee?token={token}&name={request.interviewee_name.replace(' ', '%20')}"
+        session_url = f"{FRONTEND_BASE_URL}/interviewee?token={token}&name={quote(request.interviewee_name, safe='')}"
         
         return SessionCreationResponse(
             ok=True, 
@@ -535,7 +705,7 @@ async def create_new_session(request: InterviewerCreateSessionRequest):
         )
 
     except Exception as e:
-        print(f"Error creating session: {e}")
+        logger.error("Error creating session: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create new interview session.")
 
 # --- 6. GET /api/job-status (QUEUE STATUS POLLING) ---
@@ -553,19 +723,19 @@ async def get_job_status(job_id: str):
     return {
         "job_id": job_id,
         "status": job.status.value,
-        "created_at": job.created_at.isoformat(),
+        "created_at": job.created_at_iso,
         "started_at": job.started_at.isoformat() if job.started_at else None,
         "completed_at": job.completed_at.isoformat() if job.completed_at else None,
-        "queue_position": len(analysis_queue.queue),  # How many jobs ahead
+        "queue_position": analysis_queue.queue_size(),  # How many jobs ahead
         "question_index": job.question_index,
         "is_manual_retry": job.is_manual_retry,
         # For failed jobs with auto-retry scheduled
-        "retry_scheduled_at": job.retry_info.auto_retry_scheduled_at.isoformat() 
-            if job.retry_info.auto_retry_scheduled_at else None,
+        "retry_scheduled_at": job.retry_info.scheduled_at_datetime().isoformat() 
+            if job.retry_info.auto_retry_scheduled_at is not None else None,
         "retry_attempt": job.retry_info.auto_retry_attempt,
         # Result (only if completed)
-        "result": job.result if job.status.value == "success" else None,
-        "error_message": job.error_message if job.status.value == "failed" else None
+        "result": job.result if job.status is JobStatus.SUCCESS else None,
+        "error_message": job.error_message if job.status is JobStatus.FAILED else None
     }
 
 @api_router.get("/queue-status")
@@ -575,32 +745,36 @@ async def get_queue_status():
 
 # --- 7. POST /api/interviewer/submit-review (XỬ LÝ LƯU REVIEW) ---
 
+async def _find_session_ref(db, token: str):
+    """
+    Session document for a token: looked up by document ID first (the normal case);
+    the 'token' field query only runs when the ID lookup misses.
+    """
+    sessions = db.collection("sessions")
+    snap = await sessions.document(token).get(field_paths=['token'])
+    if snap.exists:
+        return snap.reference
+    # Nếu không tìm thấy theo ID, tìm theo field 'token'
+    found = await sessions.where("token", "==", token).limit(1).get()
+    return found[0].reference if found else None
+
+
 @api_router.post("/interviewer/submit-review", response_model=OkResponse, status_code=status.HTTP_200_OK)
-async def submit_review(review_data: ReviewSubmission):
+async def submit_review(review_data: ReviewSubmission, db: firestore_async.AsyncClient = Depends(require_firestore)):
     """
     Nhận điểm và nhận xét từ Interviewer, lưu vào Firestore.
     """
-    db = get_firestore_client()
-    if not db:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database connection error.")
-
     try:
-        print(f"[submit-review] Saving review for Token: {review_data.token}, Q{review_data.question_index}")
+        logger.info("[submit-review] Saving review for Token: %s, Q%s", review_data.token, review_data.question_index)
 
-        # 1. Tìm Session Document (Ưu tiên tìm theo ID)
-        session_ref = db.collection("sessions").document(review_data.token)
-        doc = session_ref.get()
-
-        # Nếu không tìm thấy theo ID, tìm theo field 'token'
-        if not doc.exists:
-            found = list(db.collection("sessions").where("token", "==", review_data.token).stream())
-            if not found:
-                raise HTTPException(status_code=404, detail="Session not found")
-            session_ref = found[0].reference
+        # 1. Tìm Session Document (theo ID, rồi theo field 'token' nếu không thấy)
+        session_ref = await _find_session_ref(db, review_data.token)
+        if session_ref is None:
+            raise HTTPException(status_code=404, detail="Session not found")
 
         # 2. Chuẩn bị dữ liệu để lưu
         # Dùng set(..., merge=True) để không ghi đè mất dữ liệu cũ
-        session_ref.set({
+        await session_ref.set({
             "reviews": {
                 # Chuyển số 0 thành string "0" để làm key trong Firestore Map
                 str(review_data.question_index): {
@@ -614,8 +788,10 @@ async def submit_review(review_data: ReviewSubmission):
 
         return OkResponse(ok=True)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error saving review: {e}")
+        logger.error("Error saving review: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Test Endpoint (Existing) ---
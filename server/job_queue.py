@@ -1,19 +1,28 @@
 """
 Job Queue System for AI Analysis
-- Implements rate limiting: 1 job per 15 seconds (4 jobs/minute, safe for 5 req/min quota)
+- Implements rate limiting: at most 4 job starts in any 60 seconds (safe for 5 req/min quota);
+  an idle queue can start a burst of 4 at once instead of spacing them 15s apart
+- Started jobs may overlap (bounded by MAX_CONCURRENT_JOBS) since each one is mostly waiting on Gemini
 - Handles auto-retry: 1 attempt after 70s delay if job fails
 - Handles manual retry: User can manually retry, goes to back of queue
 """
 import asyncio
+import heapq
+import itertools
 import time
 import logging
-from typing import Dict, List, Optional, Callable
+from collections import deque
+from typing import Deque, Dict, List, Optional, Callable, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+class QueueFullError(Exception):
+    """Raised by add_job when MAX_QUEUE_SIZE jobs are already waiting."""
+
+
 class JobStatus(Enum):
     """Job lifecycle states"""
     PENDING = "pending"           # Waiting in queue
@@ -23,18 +32,30 @@ class JobStatus(Enum):
     RETRY_SCHEDULED = "retry_scheduled"  # Waiting for auto-retry delay
     MANUAL_RETRY_PENDING = "manual_retry_pending"  # User clicked retry, waiting in queue
 
+
+# Status groups tested on hot paths (frozenset: one hash probe, nothing built per call)
+TERMINAL_STATES = frozenset({JobStatus.SUCCESS, JobStatus.FAILED})
+
 @dataclass
 class JobRetryInfo:
     """Tracks retry attempts for a job"""
     auto_retry_attempt: int = 0  # 0 or 1 (max 1 auto-retry)
-    auto_retry_scheduled_at: Optional[datetime] = None  # When auto-retry should run
+    auto_retry_scheduled_at: Optional[float] = None  # time.monotonic() when auto-retry should run
     last_error: str = ""
+    
+    def scheduled_at_datetime(self) -> Optional[datetime]:
+        """Wall-clock time of the scheduled auto-retry, for logs and the API (None if not scheduled)."""
+        if self.auto_retry_scheduled_at is None:
+            return None
+        return datetime.now() + timedelta(seconds=self.auto_retry_scheduled_at - time.monotonic())
 
-@dataclass
+@dataclass(eq=False)
 class AnalysisJob:
     """
     Represents a single AI analysis job.
     One job = one question video from one candidate.
+    There is one instance per job_id (kept in AnalysisQueue.jobs_dict), so jobs
+    compare and hash by identity.
     """
     job_id: str  # Unique identifier (e.g., "session_token:q_index")
     token: str  # Session token
@@ -42,6 +63,8 @@ class AnalysisJob:
     question_index: int  # 0-based question index
     question_text: str  # Question text for AI prompt
     video_path: str  # Path to video file
+    duration_seconds: int = 0  # Recorded answer length (from upload), used for pace
+    video_sha256: str = ""  # Digest computed while the upload streamed ("" = unknown)
     
     # Metadata
     created_at: datetime = field(default_factory=datetime.now)
@@ -59,13 +82,17 @@ class AnalysisJob:
     # Frontend tracking
     is_manual_retry: bool = False  # True if user manually triggered retry
     
-    def __hash__(self):
-        return hash(self.job_id)
+    # Sequence number of this job's live entry in AnalysisQueue.queue (-1 = not queued)
+    queue_seq: int = -1
     
-    def __eq__(self, other):
-        if isinstance(other, AnalysisJob):
-            return self.job_id == other.job_id
-        return False
+    # Set when the job reaches SUCCESS or FAILED (see wait_for_job_completion)
+    done_event: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    
+    # created_at formatted once for status responses
+    created_at_iso: str = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        self.created_at_iso = self.created_at.isoformat()
 
 
 class AnalysisQueue:
@@ -73,56 +100,99 @@ class AnalysisQueue:
     Queue for AI analysis jobs with rate limiting.
     
     Key features:
-    - Max 1 job per 15 seconds (4 jobs/min, safe under 5 req/min quota)
+    - Max 4 job starts per sliding 60s window (safe under 5 req/min quota, bursts allowed)
+    - Up to MAX_CONCURRENT_JOBS jobs in flight at once
     - Auto-retry: 1 retry after 70s delay if job fails
     - Manual retry: User can manually retry, job goes to back of queue
+    - Bounded: at most MAX_QUEUE_SIZE waiting jobs (QueueFullError beyond that)
+    - Ready jobs live in a deque (O(1) at both ends); scheduled auto-retries in a
+      min-heap keyed on their due time, so a worker tick never scans the whole queue
+    - Membership is a set of job ids; moving a job leaves its old deque entry behind
+      as a tombstone (sequence mismatch) that is skipped when popped
     - Tracks job status for frontend
     """
     
     # Configuration
-    JOB_PROCESSING_INTERVAL = 15  # seconds between job processing
+    RATE_LIMIT_JOBS = 4  # job starts (Gemini requests) allowed per window
+    RATE_LIMIT_WINDOW = 60  # seconds
+    JOB_PROCESSING_INTERVAL = RATE_LIMIT_WINDOW // RATE_LIMIT_JOBS  # average spacing, used as Retry-After
     AUTO_RETRY_DELAY = 70  # seconds to wait before auto-retry
+    MAX_CONCURRENT_JOBS = 4  # jobs allowed to run at the same time
+    MAX_BATCH_SIZE = 5  # ready jobs of one session analyzed in a single request
+    MAX_QUEUE_SIZE = 256  # waiting jobs; beyond this new work is refused instead of piling up
     
     def __init__(self):
-        self.queue: List[AnalysisJob] = []  # FIFO queue
+        self.queue: Deque[Tuple[int, AnalysisJob]] = deque()  # FIFO of (seq, job) ready to run
+        self.queued_ids: set = set()  # job_ids with a live entry in self.queue
+        # Same entries indexed by session token, in the same order (drain_all pops from here)
+        self.ready_by_token: Dict[str, Deque[Tuple[int, AnalysisJob]]] = {}
+        self._queue_counter = itertools.count()
+        self._status_jobs: Optional[List[Dict]] = None  # get_queue_status "jobs" list; None = rebuild
+        self.retry_heap: List[Tuple[float, int, str]] = []  # (due epoch, tiebreak, job_id) of scheduled auto-retries
+        self._retry_counter = itertools.count()
         self.jobs_dict: Dict[str, AnalysisJob] = {}  # job_id -> job mapping for quick lookup
-        self.last_job_time = 0  # Timestamp of when last job started processing
-        self.processing = False  # Currently processing a job
+        # time.monotonic() of the last RATE_LIMIT_JOBS job starts (all scheduling math is monotonic)
+        self.start_times: Deque[float] = deque(maxlen=self.RATE_LIMIT_JOBS)
+        self.active_jobs = 0  # Number of jobs currently running
         self.current_job: Optional[AnalysisJob] = None  # Job being processed
         self.workers_started = False
-        
+        self.wakeup = asyncio.Event()  # Set (via notify_worker) when the worker should re-check the queue
+        self.worker_wake_at = float('inf')  # monotonic time the waiting worker wakes by itself (inf = only on wakeup)
+    
     def add_job(self, token: str, folder: str, question_index: int, 
-                question_text: str, video_path: str, is_manual_retry: bool = False) -> str:
+                question_text: str, video_path: str, is_manual_retry: bool = False,
+                duration_seconds: int = 0, video_sha256: str = "") -> str:
         """
         Add a new job to queue.
         
         Returns:
             job_id: Unique identifier for this job
+        
+        Raises:
+            QueueFullError: the job would have to be queued but the queue is full
         """
         job_id = f"{token}:q{question_index}"
         
+        existing = self.jobs_dict.get(job_id)
+        grows_queue = existing is None or job_id not in self.queued_ids
+        if grows_queue and self.waiting_count() >= self.MAX_QUEUE_SIZE:
+            logger.warning("[Queue] Full (%s waiting), refusing %s", self.waiting_count(), job_id)
+            raise QueueFullError(f"Analysis queue is full ({self.MAX_QUEUE_SIZE} jobs waiting)")
+        
         # If this is a retry of an existing job, update the existing job
         if job_id in self.jobs_dict:
             existing_job = self.jobs_dict[job_id]
+            if video_sha256:
+                existing_job.video_sha256 = video_sha256
             
             if is_manual_retry:
+                # Same recording: keep the upload's question text, refresh the length if known
+                if duration_seconds:
+                    existing_job.duration_seconds = duration_seconds
                 # User clicked manual retry button
                 # Move to back of queue with updated status
-                if existing_job in self.queue:
-                    self.queue.remove(existing_job)
-                
+                # (a pending auto-retry heap entry goes stale and is skipped when popped)
                 existing_job.status = JobStatus.MANUAL_RETRY_PENDING
                 existing_job.is_manual_retry = True
-                self.queue.append(existing_job)
-                logger.info(f"[Queue] Manual retry for {job_id}, position: {len(self.queue)}")
+                existing_job.done_event.clear()
+                self._enqueue(existing_job)
+                self.notify_worker()
+                logger.info("[Queue] Manual retry for %s, position: %s", job_id, self.queue_size())
             else:
-                # Auto-retry after failure
-                existing_job.retry_info.auto_retry_attempt += 1
-                existing_job.status = JobStatus.RETRY_SCHEDULED
-                existing_job.retry_info.auto_retry_scheduled_at = datetime.now() + timedelta(seconds=self.AUTO_RETRY_DELAY)
+                # Question re-uploaded: new recording, so the job starts over
+                # (its auto-retry is not used up; a pending heap entry goes stale)
+                existing_job.folder = folder
+                existing_job.video_path = video_path
+                existing_job.question_text = question_text
+                existing_job.duration_seconds = duration_seconds
+                existing_job.retry_info = JobRetryInfo()
+                existing_job.status = JobStatus.PENDING
+                existing_job.error_message = ""
                 existing_job.is_manual_retry = False
-                # Don't add back to queue yet - will be added when delay expires
-                logger.info(f"[Queue] Auto-retry scheduled for {job_id} at {existing_job.retry_info.auto_retry_scheduled_at}")
+                existing_job.done_event.clear()
+                self._enqueue(existing_job)
+                self.notify_worker()
+                logger.info("[Queue] Re-upload for %s, position: %s", job_id, self.queue_size())
             
             return job_id
         
@@ -134,12 +204,15 @@ class AnalysisQueue:
             question_index=question_index,
             question_text=question_text,
             video_path=video_path,
+            duration_seconds=duration_seconds,
+            video_sha256=video_sha256,
             is_manual_retry=is_manual_retry
         )
         
         self.jobs_dict[job_id] = job
-        self.queue.append(job)
-        logger.info(f"[Queue] Added job {job_id}, queue size: {len(self.queue)}")
+        self._enqueue(job)
+        self.notify_worker()
+        logger.info("[Queue] Added job %s, queue size: %s", job_id, self.queue_size())
         
         return job_id
     
@@ -159,7 +232,9 @@ class AnalysisQueue:
         job.result = result
         job.completed_at = datetime.now()
         self.current_job = None
-        logger.info(f"[Queue] Job {job.job_id} completed successfully")
+        job.done_event.set()  # Worker runs on the app loop, so waiters wake directly
+        self.notify_worker()
+        logger.info("[Queue] Job %s completed successfully", job.job_id)
     
     def mark_failed(self, job: AnalysisJob, error: str):
         """
@@ -171,11 +246,11 @@ class AnalysisQueue:
         # Check if auto-retry is available
         if job.retry_info.auto_retry_attempt == 0:
             # Schedule auto-retry
-            job.status = JobStatus.RETRY_SCHEDULED
             job.retry_info.auto_retry_attempt += 1
-            job.retry_info.auto_retry_scheduled_at = datetime.now() + timedelta(seconds=self.AUTO_RETRY_DELAY)
             job.retry_info.last_error = error
-            logger.info(f"[Queue] Job {job.job_id} failed, auto-retry scheduled for {job.retry_info.auto_retry_scheduled_at}")
+            self._schedule_retry(job)
+            self.notify_worker(job.retry_info.auto_retry_scheduled_at)
+            logger.info("[Queue] Job %s failed, auto-retry scheduled for %s", job.job_id, job.retry_info.scheduled_at_datetime())
             self.current_job = None
             return
         
@@ -183,15 +258,140 @@ class AnalysisQueue:
         job.status = JobStatus.FAILED
         job.completed_at = datetime.now()
         self.current_job = None
-        logger.info(f"[Queue] Job {job.job_id} failed permanently: {error}")
+        job.done_event.set()  # Worker runs on the app loop, so waiters wake directly
+        self.notify_worker()
+        logger.info("[Queue] Job %s failed permanently: %s", job.job_id, error)
+    
+    def notify_worker(self, eligible_at: Optional[float] = None):
+        """
+        Wake the worker if work can start before the time it already plans to wake at.
+        eligible_at: monotonic time the new work becomes runnable (default: now); the
+        rate limit is applied here, so e.g. a job added while the worker waits for a
+        free slot in the window does not wake it early just to go back to sleep.
+        """
+        if eligible_at is None:
+            eligible_at = time.monotonic()
+        eligible_at = max(eligible_at, self._next_start_slot())
+        if eligible_at < self.worker_wake_at:
+            self.wakeup.set()
+    
+    def _schedule_retry(self, job: AnalysisJob):
+        """Put job on the retry heap, due AUTO_RETRY_DELAY seconds from now."""
+        job.status = JobStatus.RETRY_SCHEDULED
+        job.retry_info.auto_retry_scheduled_at = time.monotonic() + self.AUTO_RETRY_DELAY
+        heapq.heappush(
+            self.retry_heap,
+            (job.retry_info.auto_retry_scheduled_at, next(self._retry_counter), job.job_id)
+        )
+    
+    def _promote_due_retries(self):
+        """Move auto-retries whose delay has expired to the front of the queue (earliest due first)."""
+        now = time.monotonic()
+        due = []
+        while self.retry_heap and self.retry_heap[0][0] <= now:
+            due_at, _, job_id = heapq.heappop(self.retry_heap)
+            job = self.jobs_dict.get(job_id)
+            # Stale entry: job was manually retried or rescheduled since this push
+            if job is None or job.status != JobStatus.RETRY_SCHEDULED \
+                    or job.retry_info.auto_retry_scheduled_at != due_at:
+                continue
+            job.status = JobStatus.PENDING
+            due.append(job)
+            logger.info("[Queue] Job %s retry delay expired, moving to front of queue", job.job_id)
+        for job in reversed(due):
+            self._enqueue(job, front=True)
+    
+    def _enqueue(self, job: AnalysisJob, front: bool = False):
+        """Add a live entry for job (any older entry becomes a tombstone)."""
+        job.queue_seq = next(self._queue_counter)
+        self.queued_ids.add(job.job_id)
+        self._status_jobs = None
+        entry = (job.queue_seq, job)
+        by_token = self.ready_by_token.setdefault(job.token, deque())
+        if front:
+            self.queue.appendleft(entry)
+            by_token.appendleft(entry)
+        else:
+            self.queue.append(entry)
+            by_token.append(entry)
+    
+    def _dequeue(self, job: AnalysisJob):
+        """Logically remove job from the queue; its entry is skipped when reached."""
+        self.queued_ids.discard(job.job_id)
+        job.queue_seq = -1
+        self._status_jobs = None
+        self._trim_token(job.token)
+    
+    def _pop_live(self, entries: Deque[Tuple[int, AnalysisJob]]) -> Optional[AnalysisJob]:
+        """Pop and dequeue the first live job of entries, dropping tombstones on the way."""
+        while entries:
+            entry = entries.popleft()
+            if self._is_live(entry):
+                self._dequeue(entry[1])
+                return entry[1]
+        return None
+    
+    def _trim_token(self, token: str):
+        """Drop tombstones at the head of a session's index (and the index once empty)."""
+        entries = self.ready_by_token.get(token)
+        if entries is None:
+            return
+        while entries and not self._is_live(entries[0]):
+            entries.popleft()
+        if not entries:
+            del self.ready_by_token[token]
+    
+    def _is_live(self, entry: Tuple[int, AnalysisJob]) -> bool:
+        seq, job = entry
+        return seq == job.queue_seq and job.job_id in self.queued_ids
+    
+    def _live_jobs(self):
+        """Queued jobs in order, skipping tombstones."""
+        return (entry[1] for entry in self.queue if self._is_live(entry))
+    
+    def queue_size(self) -> int:
+        """Jobs ready to run (tombstones excluded)."""
+        return len(self.queued_ids)
+    
+    def waiting_count(self) -> int:
+        """Jobs not yet started: ready ones plus scheduled auto-retries (may include stale heap entries)."""
+        return self.queue_size() + len(self.retry_heap)
+    
+    def _next_start_slot(self) -> float:
+        """time.monotonic() from which another job may start under the sliding-window limit."""
+        if len(self.start_times) < self.RATE_LIMIT_JOBS:
+            return 0.0
+        return self.start_times[0] + self.RATE_LIMIT_WINDOW
+    
+    def record_job_start(self):
+        """Count one Gemini request (a job or a same-session batch) against the rate limit."""
+        self.start_times.append(time.monotonic())
     
     def should_process_next(self) -> bool:
-        """Check if enough time has passed to process next job"""
-        if self.processing or not self.queue:
+        """Check if a job is ready and the rate limit allows starting it"""
+        if self.active_jobs >= self.MAX_CONCURRENT_JOBS:
+            return False
+        self._promote_due_retries()
+        if not self.queued_ids:
             return False
         
-        now = time.time()
-        return (now - self.last_job_time) >= self.JOB_PROCESSING_INTERVAL
+        return time.monotonic() >= self._next_start_slot()
+    
+    def next_eligible_time(self) -> Optional[float]:
+        """
+        time.monotonic() at which should_process_next() can next turn True without a new event,
+        or None if only an event (new job, finished job) can change that.
+        """
+        if self.active_jobs >= self.MAX_CONCURRENT_JOBS:
+            return None
+        candidates = []
+        if self.queued_ids:
+            candidates.append(time.monotonic())
+        if self.retry_heap:
+            candidates.append(self.retry_heap[0][0])
+        if not candidates:
+            return None
+        return max(min(candidates), self._next_start_slot())
     
     def get_next_job(self) -> Optional[AnalysisJob]:
         """
@@ -199,40 +399,59 @@ class AnalysisQueue:
         - Check queue for jobs ready to process
         - For jobs in RETRY_SCHEDULED state, only return if delay has passed
         """
-        # First, check if any RETRY_SCHEDULED jobs are now ready
-        now = datetime.now()
-        for i, job in enumerate(self.queue):
-            if job.status == JobStatus.RETRY_SCHEDULED:
-                if job.retry_info.auto_retry_scheduled_at and now >= job.retry_info.auto_retry_scheduled_at:
-                    # This job's retry delay has expired, move it to front
-                    job.status = JobStatus.PENDING
-                    self.queue.pop(i)
-                    self.queue.insert(0, job)
-                    logger.info(f"[Queue] Job {job.job_id} retry delay expired, moving to front of queue")
-                    break
+        # First, move RETRY_SCHEDULED jobs whose delay has passed to the front (heap: O(log n) each)
+        self._promote_due_retries()
         
-        # Return first job in queue (should be PENDING status)
-        if self.queue and self.queue[0].status in [JobStatus.PENDING, JobStatus.MANUAL_RETRY_PENDING]:
-            return self.queue.pop(0)
+        # Return first live job in queue (tombstones left by moved/removed jobs are skipped)
+        return self._pop_live(self.queue)
+    
+    def drain_all(self, token: Optional[str] = None, limit: Optional[int] = None) -> List[AnalysisJob]:
+        """
+        Pop every job that is ready to run right now, in queue order.
+        - token: only drain jobs of this session
+        - limit: drain at most this many jobs
+        Used to send a session's backlog to Gemini as one batched request.
+        Pops from the session's own index, so the cost is the jobs taken (plus any
+        tombstones passed), not the length of the whole queue; entries left in the
+        main deque become tombstones.
+        """
+        source = self.queue if token is None else self.ready_by_token.get(token)
+        drained = []
+        while source and (limit is None or len(drained) < limit):
+            job = self._pop_live(source)
+            if job is None:
+                break
+            drained.append(job)
         
-        return None
+        if drained:
+            logger.info("[Queue] Drained %s ready jobs for batching", len(drained))
+        return drained
     
     def get_queue_status(self) -> Dict:
-        """Get current queue status for monitoring/debugging"""
-        return {
-            "queue_size": len(self.queue),
-            "current_job": self.current_job.job_id if self.current_job else None,
-            "processing": self.processing,
-            "last_job_time": self.last_job_time,
-            "jobs": [
+        """
+        Get current queue status for monitoring/debugging.
+        The per-job list is cached until the queue changes (_enqueue/_dequeue); queued
+        jobs' status and retry flag are only changed right before they are enqueued.
+        """
+        if self._status_jobs is None:
+            self._status_jobs = [
                 {
                     "job_id": job.job_id,
                     "status": job.status.value,
-                    "created_at": job.created_at.isoformat(),
+                    "created_at": job.created_at_iso,
                     "is_manual_retry": job.is_manual_retry
                 }
-                for job in self.queue
+                for job in self._live_jobs()
             ]
+        return {
+            "queue_size": self.queue_size(),
+            "scheduled_retries": len(self.retry_heap),
+            "current_job": self.current_job.job_id if self.current_job else None,
+            "processing": self.active_jobs > 0,
+            "active_jobs": self.active_jobs,
+            # as epoch seconds (0 = no job started yet)
+            "last_job_time": time.time() - (time.monotonic() - self.start_times[-1]) if self.start_times else 0,
+            "jobs": self._status_jobs
         }
 
 
@@ -251,22 +470,15 @@ async def wait_for_job_completion(job_id: str, timeout: int = 300) -> Optional[D
     Returns:
         Job result if successful, None if failed or timed out
     """
-    start_time = time.time()
+    job = analysis_queue.get_job(job_id)
+    if not job:
+        return None
     
-    while time.time() - start_time < timeout:
-        job = analysis_queue.get_job(job_id)
-        
-        if not job:
-            return None
-        
-        if job.status == JobStatus.SUCCESS:
-            return job.result
-        
-        if job.status == JobStatus.FAILED:
+    # Still processing or in queue: sleep until mark_success / mark_failed sets the event
+    if job.status not in TERMINAL_STATES:
+        try:
+            await asyncio.wait_for(job.done_event.wait(), timeout)
+        except asyncio.TimeoutError:
             return None
-        
-        # Still processing or in queue, wait and retry
-        await asyncio.sleep(1)
     
-    # Timeout
-    return None
+    return job.result if job.status == JobStatus.SUCCESS else None
@@ -2,8 +2,13 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse
 import os
 import sys
+import asyncio
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
 
 # Load environment variables from .env file in the server directory
@@ -25,7 +30,7 @@ sys.stdout.reconfigure(encoding='utf-8')
 sys.stderr.reconfigure(encoding='utf-8')
 
 from server.api.router import api_router # Import the API router we just created
-from server.api.firebase_setup import initialize_firebase # <-- Import the Firebase initialization function
+from server.api.firebase_setup import get_firestore_client, warm_firestore, warm_async_firestore # <-- Import the Firebase initialization function
 from server.queue_worker import queue_worker  # Import queue worker
 
 # --- FASTAPI APPLICATION INITIALIZATION ---
@@ -56,6 +61,24 @@ app.add_middleware(
     allow_headers=["*"], # Allow all headers
 )
 
+# --- LOGGING ---
+# Handlers write to stdout/stderr from one listener thread; request handlers only enqueue records
+_log_listener = None
+
+def install_queue_logging():
+    """Move the root logger's handlers behind a QueueHandler/QueueListener pair."""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    root = logging.getLogger()
+    handlers = root.handlers[:] or [logging.StreamHandler()]
+    for handler in handlers:
+        root.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    root.addHandler(QueueHandler(log_queue))
+    _log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _log_listener.start()
+
 # --- LIFECYCLE HOOK (Database Initialization) ---
 @app.on_event("startup")
 async def startup_event():
@@ -63,8 +86,12 @@ async def startup_event():
     Initializes Firebase and the database client when the server starts.
     Also starts the background queue worker.
     """
+    install_queue_logging()
     print("Application Startup: Initializing Firebase...")
-    initialize_firebase()
+    # The sync client is blocking (gRPC only): build and warm it off the event loop
+    await asyncio.to_thread(get_firestore_client)
+    await asyncio.to_thread(warm_firestore)
+    await warm_async_firestore()
     
     print("Application Startup: Starting queue worker...")
     queue_worker.start()
@@ -75,16 +102,34 @@ async def shutdown_event():
     Stops the queue worker when the server shuts down.
     """
     print("Application Shutdown: Stopping queue worker...")
-    queue_worker.stop()
+    await queue_worker.stop()
+    if _log_listener is not None:
+        _log_listener.stop()  # Flushes records still in the queue
 
 # --- API ROUTER INCLUSION ---
 
 app.include_router(api_router)
 
 # Serve uploaded files (video + transcripts) from the `server/uploads` folder
+UPLOAD_STREAM_CHUNK_SIZE = 1 << 20  # 1 MB per read (Starlette default is 64 KB)
+
+
+class UploadFiles(StaticFiles):
+    """
+    StaticFiles with larger read chunks. Every chunk of a FileResponse is one
+    worker-thread read, so a 20 MB answer video takes ~20 hops instead of ~320.
+    Range requests, ETag and 304 handling are unchanged.
+    """
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        if isinstance(response, FileResponse):
+            response.chunk_size = UPLOAD_STREAM_CHUNK_SIZE
+        return response
+
+
 uploads_path = os.path.join(os.path.dirname(__file__), 'uploads')
 os.makedirs(uploads_path, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=uploads_path), name="uploads")
+app.mount("/uploads", UploadFiles(directory=uploads_path), name="uploads")
 
 # --- HEALTH CHECK ENDPOINT ---
 
@@ -0,0 +1,92 @@
+"""
+meta.json Storage Helpers
+- Reads and writes per-session meta.json with orjson (C serializer, UTF-8 bytes in/out)
+- 64 KB buffered file handles so each read/write is a single syscall for typical files
+- File lock so concurrent jobs don't interleave read-modify-write cycles
+- Atomic saves (temp file + os.replace): readers never see a half-written meta.json
+- record_upload: the upload endpoint's entry + size total in one locked write, so the
+  review page (which fetches meta.json directly) sees "Processing..." right away
+"""
+import os
+import tempfile
+import orjson
+from filelock import FileLock
+
+IO_BUFFER_SIZE = 65536  # 64 KB
+DUMP_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+LOCK_TIMEOUT = 10  # seconds to wait for another writer before giving up
+
+# Process umask, read once at import (os.umask can only be read by setting it)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def load_meta(path: str) -> dict:
+    """
+    Read and parse a meta.json file.
+    Legacy files written with a Windows code page (cp1252) are not valid UTF-8; they are
+    decoded as cp1252 with replacement, and the next save_meta rewrites them as UTF-8.
+    """
+    with open(path, 'rb', buffering=IO_BUFFER_SIZE) as f:
+        raw = f.read()
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        try:
+            raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return orjson.loads(raw.decode('cp1252', errors='replace'))
+        raise
+
+
+def save_meta(path: str, metadata: dict):
+    """
+    Serialize metadata and write it to path (UTF-8, non-ASCII kept as-is).
+    Written to a temp file in the same folder and renamed over path, so the review
+    page (served meta.json directly) never reads a truncated file.
+    mkstemp creates the temp file as 0600, so it gets the old file's mode (or the
+    usual 0644-style default for a new file) before it replaces path.
+    """
+    data = orjson.dumps(metadata, option=DUMP_OPTIONS)
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with open(fd, 'wb', buffering=IO_BUFFER_SIZE) as f:
+            if hasattr(os, 'fchmod'):  # POSIX only; Windows has no such permission bits
+                os.fchmod(f.fileno(), mode)
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def meta_lock(path: str) -> FileLock:
+    """Lock to hold around a read-modify-write of the meta.json at path."""
+    return FileLock(path + '.lock', timeout=LOCK_TIMEOUT)
+
+
+def record_upload(meta_path: str, question_index: int, entry: dict) -> float:
+    """
+    Store one question's upload entry in meta.json and keep videoSizeTotalMB as a running
+    total: the question's previous size (re-upload) is taken out and the new one added,
+    instead of re-summing every entry.
+    A missing meta.json starts from an empty one; one that exists but cannot be parsed
+    raises instead, so the file is never overwritten with only this entry.
+    Returns the new total (blocking; run via asyncio.to_thread).
+    """
+    with meta_lock(meta_path):
+        try:
+            metadata = load_meta(meta_path)
+        except FileNotFoundError:
+            metadata = {}
+        received = metadata.setdefault('receivedQuestions', {})
+        prev = received.get(str(question_index), {}).get('sizeMB', 0)
+        received[str(question_index)] = entry
+        total = round(metadata.get('videoSizeTotalMB', 0) - prev + entry.get('sizeMB', 0), 2)
+        metadata['videoSizeTotalMB'] = total
+        save_meta(meta_path, metadata)
+        return total
@@ -1,16 +1,17 @@
 """
 Queue Worker Service
 - Processes jobs from analysis_queue in background
-- Respects 15s throttling between jobs
+- Respects the queue's rate limit (4 job starts per 60s window)
+- Runs as an asyncio task on the app's event loop; started jobs run concurrently
+- Sleeps until the queue signals new work or the next job/retry becomes eligible (no polling)
 - Handles auto-retry logic
 """
 import asyncio
 import logging
 import time
-from threading import Thread, Event
 
 from server.job_queue import analysis_queue, JobStatus
-from server.ai_service_v2 import process_job_from_queue
+from server.ai_service_v2 import process_job_from_queue, process_jobs_batch
 
 logger = logging.getLogger(__name__)
 
@@ -20,66 +21,97 @@ class QueueWorker:
     
     def __init__(self):
         self.running = False
-        self.worker_thread = None
-        self.stop_event = Event()
+        self.worker_task = None
     
     def start(self):
-        """Start the background worker thread"""
+        """Start the worker loop as a task on the running event loop (call from app startup)."""
         if self.running:
             logger.warning("[Queue Worker] Already running")
             return
         
         self.running = True
-        self.stop_event.clear()
-        self.worker_thread = Thread(target=self._worker_loop, daemon=True)
-        self.worker_thread.start()
+        self.worker_task = asyncio.create_task(self.run())
         logger.info("[Queue Worker] Started")
     
-    def stop(self):
-        """Stop the background worker thread"""
+    async def stop(self):
+        """Stop the worker loop (jobs already started are left to finish or be cancelled with the loop)."""
         if not self.running:
             return
         
         self.running = False
-        self.stop_event.set()
-        if self.worker_thread:
-            self.worker_thread.join(timeout=5)
+        analysis_queue.wakeup.set()
+        if self.worker_task:
+            try:
+                await asyncio.wait_for(self.worker_task, timeout=5)
+            except asyncio.TimeoutError:
+                self.worker_task.cancel()
         logger.info("[Queue Worker] Stopped")
     
-    def _worker_loop(self):
+    async def run(self):
         """
         Main worker loop.
-        Continuously processes jobs from queue, respecting throttling.
+        Continuously dispatches jobs from queue, respecting throttling.
+        Jobs run as tasks so several Gemini calls can be in flight at once.
+        Between dispatches it waits on analysis_queue.wakeup, with a timeout only
+        when the rate limit or a scheduled retry will make a job eligible on its own;
+        notify_worker() only interrupts that wait for work that can start sooner.
         """
         logger.info("[Queue Worker] Worker loop started")
+        tasks = set()
         
-        while self.running and not self.stop_event.is_set():
+        while self.running:
             try:
+                # Cleared before looking at the queue: anything that changes it after this wakes us
+                analysis_queue.wakeup.clear()
+                
                 # Check if we should process next job
                 if analysis_queue.should_process_next():
                     job = analysis_queue.get_next_job()
                     
                     if job:
-                        logger.info(f"[Queue Worker] Processing: {job.job_id}")
+                        # Other ready answers of the same session ride along in one request
+                        batch = [job] + analysis_queue.drain_all(
+                            token=job.token, limit=analysis_queue.MAX_BATCH_SIZE - 1
+                        )
+                        logger.info("[Queue Worker] Processing: %s", [j.job_id for j in batch])
                         
                         # Update timing
-                        analysis_queue.last_job_time = time.time()
-                        analysis_queue.processing = True
+                        analysis_queue.record_job_start()
+                        analysis_queue.active_jobs += 1
                         
-                        try:
-                            # Process the job (this may take a while)
-                            process_job_from_queue(job)
-                        except Exception as e:
-                            logger.error(f"[Queue Worker] Unhandled error processing {job.job_id}: {e}")
-                        finally:
-                            analysis_queue.processing = False
+                        task = asyncio.create_task(self._process_job(batch))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        continue
                 
-                # Sleep briefly before checking queue again
-                time.sleep(1)
+                # Sleep until new work arrives or the next job becomes eligible
+                wake_at = analysis_queue.next_eligible_time()
+                timeout = None if wake_at is None else max(0.0, wake_at - time.monotonic())
+                analysis_queue.worker_wake_at = float('inf') if wake_at is None else wake_at
+                try:
+                    await asyncio.wait_for(analysis_queue.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    analysis_queue.worker_wake_at = float('inf')
                 
             except Exception as e:
-                logger.error(f"[Queue Worker] Unexpected error in worker loop: {e}")
-                time.sleep(5)  # Back off on error
+                logger.error("[Queue Worker] Unexpected error in worker loop: %s", e)
+                await asyncio.sleep(5)  # Back off on error
+    
+    async def _process_job(self, batch):
+        """Run one job (or a same-session batch) and release its concurrency slot."""
+        try:
+            # Process the job (this may take a while)
+            if len(batch) == 1:
+                await process_job_from_queue(batch[0])
+            else:
+                await process_jobs_batch(batch)
+        except Exception as e:
+            logger.error("[Queue Worker] Unhandled error processing %s: %s", [j.job_id for j in batch], e)
+        finally:
+            analysis_queue.active_jobs -= 1
+            analysis_queue.notify_worker()  # A concurrency slot is free again
 
 
 # Global worker instance
@@ -0,0 +1,82 @@
+"""
+Gemini Result Cache
+- Keyed by (sha256 of the video bytes, question text): identical re-submissions skip Gemini
+- Stores the parsed model output, not derived pace, so duration changes are still honored
+- In-process LRU in front of one small JSON file per entry under CACHE_DIR (survives restarts)
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.getenv("AI_CACHE_DIR", os.path.join(os.path.dirname(__file__), '.cache', 'ai'))
+MAX_MEMORY_ENTRIES = 256
+HASH_BUFFER_SIZE = 65536  # 64 KB
+
+_memory: "OrderedDict[str, dict]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def video_digest(video_path: str) -> str:
+    """sha256 hex digest of a video file (blocking; run via asyncio.to_thread)."""
+    with open(video_path, 'rb', buffering=HASH_BUFFER_SIZE) as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def _key(digest: str, question_text: str) -> str:
+    question_hash = hashlib.sha256(question_text.encode('utf-8')).hexdigest()[:16]
+    return f"{digest}_{question_hash}"
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def get(digest: str, question_text: str) -> Optional[dict]:
+    """Cached {"ai_data", "raw_response"} for this video + question, or None."""
+    key = _key(digest, question_text)
+    with _lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+            return entry
+
+    try:
+        with open(_disk_path(key), 'rb') as f:
+            entry = orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"[Cache] Unreadable cache entry {key}: {e}")
+        return None
+
+    _remember(key, entry)
+    return entry
+
+
+def put(digest: str, question_text: str, ai_data: dict, raw_response: str):
+    """Store one successful analysis in memory and on disk."""
+    key = _key(digest, question_text)
+    entry = {"ai_data": ai_data, "raw_response": raw_response}
+    _remember(key, entry)
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(_disk_path(key), 'wb') as f:
+            f.write(orjson.dumps(entry))
+    except Exception as e:
+        logger.warning(f"[Cache] Could not persist cache entry {key}: {e}")
+
+
+def _remember(key: str, entry: dict):
+    with _lock:
+        _memory[key] = entry
+        _memory.move_to_end(key)
+        while len(_memory) > MAX_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
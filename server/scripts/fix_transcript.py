@@ -53,31 +53,29 @@ def fix_transcript(folder, token):
         # rotate: keep existing backup
         os.remove(transcript_path)
 
-    pattern = re.compile(r'^(Q(\d+)):\s*(.*?)\s*\|\s*Answer:\s*(.*)$')
-
-    with open(backup_path, 'r', encoding='utf-8') as fin, open(transcript_path, 'w', encoding='utf-8') as fout:
-        for line in fin:
-            line = line.rstrip('\n')
-            m = pattern.match(line)
-            if m:
-                qlabel = m.group(1)
-                qnum = int(m.group(2))
-                qtext = m.group(3).strip()
-                answer = m.group(4).strip()
-
-                if not qtext or qtext in ('[Question text unavailable]', '\u00a0'):
-                    replacement = ''
-                    if 0 <= qnum - 1 < len(questions):
-                        replacement = questions[qnum - 1]
-                    else:
-                        replacement = '[Question text unavailable]'
-                    new_line = f"{qlabel}: {replacement} | Answer: {answer}"
-                    fout.write(new_line + '\n')
-                else:
-                    fout.write(line + '\n')
-            else:
-                # Try to handle older multi-line entries: just copy
-                fout.write(line + '\n')
+    # One pass over the whole file; [^\S\n] is \s without newline so a match never spans lines
+    pattern = re.compile(r'^(Q(\d+)):[^\S\n]*(.*?)[^\S\n]*\|[^\S\n]*Answer:[^\S\n]*(.*)$', re.MULTILINE)
+    questions = tuple(questions)
+
+    def repl(m):
+        qtext = m.group(3).strip()
+        if qtext and qtext not in ('[Question text unavailable]', '\u00a0'):
+            return m.group(0)
+        qnum = int(m.group(2))
+        if 0 <= qnum - 1 < len(questions):
+            replacement = questions[qnum - 1]
+        else:
+            replacement = '[Question text unavailable]'
+        return f"{m.group(1)}: {replacement} | Answer: {m.group(4).strip()}"
+
+    with open(backup_path, 'r', encoding='utf-8') as fin:
+        text = fin.read()
+    # Older multi-line entries don't match and are copied as-is
+    new_text = pattern.sub(repl, text)
+    if new_text and not new_text.endswith('\n'):
+        new_text += '\n'
+    with open(transcript_path, 'w', encoding='utf-8') as fout:
+        fout.write(new_text)
 
     print(f'Fixed transcript written to: {transcript_path} (backup at {backup_path})')
 
@@ -10,32 +10,40 @@ encoding (e.g., cp1252 on Windows) and produce decoding errors when read as UTF-
 """
 import os
 import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 
 BASE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
+MAX_WORKERS = 32  # folders probed at once; the work is file I/O, so threads overlap it
 
 def repair_one(path):
     meta_path = os.path.join(path, 'meta.json')
-    if not os.path.exists(meta_path):
+    # Read once; both the UTF-8 check and the cp1252 fallback work on these bytes
+    try:
+        with open(meta_path, 'rb') as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        print(f"Could not read {meta_path}: {e}")
         return False
     try:
-        with open(meta_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # orjson validates UTF-8 itself; a decode error means the file needs repair
+        orjson.loads(raw)
         # nothing to do
         return True
-    except Exception as e:
+    except orjson.JSONDecodeError as e:
         print(f"Reading as UTF-8 failed for {meta_path}: {e}")
         # Try cp1252 fallback and rewrite as utf-8
         try:
-            with open(meta_path, 'r', encoding='cp1252', errors='replace') as f:
-                content = f.read()
-            data = json.loads(content)
+            data = json.loads(raw.decode('cp1252', errors='replace'))  # stdlib json only for this legacy branch
         except Exception as e2:
             print(f"Failed to parse even after cp1252 fallback: {e2}")
             return False
 
         try:
-            with open(meta_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
+            with open(meta_path, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
             print(f"Rewrote {meta_path} as UTF-8 successfully.")
             return True
         except Exception as e3:
@@ -46,11 +54,16 @@ def main():
     if not os.path.isdir(BASE):
         print('No uploads directory found, nothing to repair.')
         return
-    folders = [d for d in os.listdir(BASE) if os.path.isdir(os.path.join(BASE, d))]
-    for f in folders:
-        folder_path = os.path.join(BASE, f)
-        print('Checking', folder_path)
-        repair_one(folder_path)
+    with os.scandir(BASE) as entries:
+        folders = [entry.path for entry in entries if entry.is_dir()]
+    if not folders:
+        print('No session folders found, nothing to repair.')
+        return
+    print(f'Checking {len(folders)} folders in {BASE}')
+    # Each folder's meta.json is independent, so they are repaired in parallel
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(folders))) as ex:
+        ok_count = sum(ex.map(repair_one, folders))
+    print(f'{ok_count} meta.json files OK, {len(folders) - ok_count} folders without meta.json or unrepairable.')
 
 if __name__ == '__main__':
     main()